@@ -1,13 +1,43 @@
-from random import randint
+from random import getrandbits
 import turtle as t
 import tkinter as tk
-from functools import lru_cache
+import argparse
+import ast
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import zlib
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property, partial
+from hashlib import sha256
+from itertools import repeat
+from math import cos, hypot, radians, sin
+from time import perf_counter
+import numpy as np
+from pngfile import SIGNATURE, png_chunk
 
 # import pyjion
 # pyjion.enable()
 
 Color = tuple[int, int, int]
 Angle = float | tuple
+Progress = Callable[[float], None]
+Chord = tuple[float, float, float, int, float]  # dx, dy, поворот, число @, радиус
+Pose = tuple[float, float, float, int]  # x, y, направление, число @
+BRANCH = np.dtype([('x', float), ('y', float), ('heading', float), ('depth', np.int64)])
+
+
+class Cancelled(Exception):
+    pass
+
+
+class OverBudget(Exception):
+    pass
 
 
 class LSystem:
@@ -15,12 +45,41 @@ class LSystem:
     axiom: str  # направление
     rules: list  # правила вида A -> B
     angle: Angle  # угол поворота в градусах
+    seed: int  # зерно для случайных углов
+    table: dict[int, str]  # таблица подстановок для str.translate
+    generations: dict[int, str | tuple[np.ndarray, np.ndarray]]  # кэш поколений: строки или коды с параметрами
+    cache_size: int = 256 * 2**20  # бюджет кэша в байтах
+    symbol_cost: int = 100  # байт на символ при построении геометрии
+    segment_cost: int = 51  # байт на отрезок в Geometry
+    lod_cost: int = 200  # байт на отрезок, пока lod держит их в списках
+    segment_rate: float = 2e5  # отрезков в секунду на expand и interpret, см. segments_per_s в task1ab_bench
 
-    def __init__(self, atoms: set, axiom: str, rules: list, angle: Angle):
+    def __init__(self, atoms: set, axiom: str, rules: list, angle: Angle, seed: int | None = None):
         self.atoms = atoms
         self.axiom = axiom
         self.rules = rules
         self.angle = angle
+        self.seed = getrandbits(32) if seed is None else seed
+        self.table = self.compile(rules)
+        self.program = Program.compile(axiom, rules)
+        # контекстно-свободные правила без параметров переписываем строками
+        self.simple = all(len(atom) == 1 for atom, _ in rules) and \
+            '(' not in axiom and not any('(' in sub for _, sub in rules)
+        self.forget()
+        self.lock = threading.Lock()
+
+    def forget(self):
+        """Drop every cached generation but the axiom"""
+        self.generations = {0: self.axiom if self.simple else self.program.axiom}
+
+    @staticmethod
+    def compile(rules: list) -> dict[int, str]:
+        """Build a translation table, the first rule for a letter wins"""
+        table = {}
+        for atom, sub in rules:
+            if len(atom) == 1:
+                table.setdefault(ord(atom), sub)
+        return table
 
     @staticmethod
     def parse(s: str) -> 'LSystem':
@@ -47,24 +106,1114 @@ class LSystem:
             s += f'{key} -> {value}\n'
         return s
 
-    @lru_cache(maxsize=16)
-    def apply(self, n: int = 1) -> str:
-        # print(self, n)
-        state = self.axiom
-        for _ in range(n):
-            new = []
-            for letter in state:
-                rule_applied = False
-                for atom, sub in self.rules:
-                    if letter == atom:
-                        new.append(sub)
-                        rule_applied = True
-                        break
-                if not rule_applied:
-                    new.append(letter)
-
-            state = ''.join(new)
-        return state
+    def apply(self, n: int = 1, progress: Progress | None = None) -> str:
+        if not self.simple:
+            return self.program.decode(*self.generate(n, progress))
+        with self.lock:
+            if n in self.generations:
+                return self.generations[n]
+            # продолжаем с ближайшего закэшированного поколения
+            k = max(i for i in self.generations if i < n)
+            state = self.generations[k]
+            for i in range(k + 1, n + 1):
+                if progress is not None:
+                    progress((i - 1 - k) / (n - k))
+                state = state.translate(self.table)
+                self.remember(i, state)
+            return state
+
+    def generate(self, n: int = 1, progress: Progress | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+        """Symbol codes of the n-th generation and their parameters, if any"""
+        if self.simple:
+            return codes_of(self.apply(n, progress)), None
+        with self.lock:
+            if n in self.generations:
+                return self.generations[n]
+            k = max(i for i in self.generations if i < n)
+            codes, params = self.generations[k]
+            for i in range(k + 1, n + 1):
+                if progress is not None:
+                    progress((i - 1 - k) / (n - k))
+                codes, params = self.program.step(codes, params)
+                self.remember(i, (codes, params))
+            return codes, params
+
+    def growth(self) -> tuple[list[str], np.ndarray]:
+        """Alphabet and growth matrix: M[i, j] is how many j's one i becomes"""
+        symbols = sorted(set(self.axiom).union(*(sub for _, sub in self.rules), (chr(c) for c in self.table)))
+        index = {c: i for i, c in enumerate(symbols)}
+        m = np.zeros((len(symbols), len(symbols)), dtype=object)
+        for i, c in enumerate(symbols):
+            for letter in self.table.get(ord(c), c):
+                m[i, index[letter]] += 1
+        return symbols, m
+
+    def counts(self, n: int) -> dict[str, int]:
+        """Exact number of every symbol in generation n, in O(k³ log n)"""
+        if not self.simple:
+            raise ValueError('Only context-free systems can be predicted')
+        symbols, m = self.growth()
+        v = np.array([self.axiom.count(c) for c in symbols], dtype=object)
+        while n:  # v @ M^n возведением в степень
+            if n & 1:
+                v = v @ m
+            m = m @ m
+            n >>= 1
+        return dict(zip(symbols, v.tolist()))
+
+    def predict(self, n: int) -> tuple[int, int]:
+        """Length and number of segments of generation n"""
+        counts = self.counts(n)
+        return sum(counts.values()), sum(counts.get(a, 0) for a in self.atoms)
+
+    def cost(self, n: int) -> int:
+        """Approximate bytes needed to expand and interpret generation n"""
+        length, segments = self.predict(n)
+        return length * self.symbol_cost + segments * self.segment_cost
+
+    def seconds(self, n: int) -> float:
+        """Approximate time needed to expand and interpret generation n"""
+        return self.predict(n)[1] / self.segment_rate
+
+    def affordable(self, n: int, budget: int, seconds: float | None = None) -> bool:
+        """Whether generation n fits in the memory budget and, if given, the time budget"""
+        if not self.simple:
+            return True
+        return self.cost(n) <= budget and (seconds is None or self.seconds(n) <= seconds)
+
+    def fitting(self, n: int, budget: int, seconds: float | None = None) -> int:
+        """The largest generation up to n that fits in the memory and time budgets"""
+        while n > 0 and not self.affordable(n, budget, seconds):
+            n -= 1
+        return n
+
+    def limit(self, budget: int, seconds: float | None = None) -> int:
+        """The most segments lod may keep within the memory and time budgets"""
+        limit = budget // self.lod_cost
+        return limit if seconds is None else min(limit, int(seconds * self.segment_rate))
+
+    def chords(self, n: int, tree: bool = False) -> list[dict[str, Chord]]:
+        """Net turtle move of every rewritten symbol after k more generations.
+
+        chords[k][c] holds the displacement, heading change and '@' count of
+        the subtree c grows into in k generations, drawn from the origin with
+        heading 0 and unit length, and the radius around its start that
+        contains it. Ranged angles are taken at their mean.
+        """
+        if not self.simple:
+            raise ValueError('Only context-free systems can be drawn with level of detail')
+        rules = {chr(c): sub for c, sub in self.table.items()}
+        chords = [{c: (1.0, 0.0, 0.0, 0, 1.0) if c in self.atoms else (0.0, 0.0, 0.0, 0, 0.0) for c in rules}]
+        for k in range(1, n + 1):
+            chords.append({c: self.chord(sub, chords[k - 1], tree) for c, sub in rules.items()})
+        return chords
+
+    def spins(self, n: int) -> list[dict[str, int]]:
+        """Number of '+' and '-' in the subtree every rewritten symbol grows into.
+
+        spins[k][c] counts them after k generations, in the same layout as chords.
+        """
+        rules = {chr(c): sub for c, sub in self.table.items()}
+        spins = [dict.fromkeys(rules, 0)]
+        for k in range(1, n + 1):
+            spins.append({c: sum(spins[k - 1][s] if s in rules else s in '+-' for s in sub)
+                          for c, sub in rules.items()})
+        return spins
+
+    def radius(self, n: int, tree: bool = False) -> float:
+        """Radius around the start that contains generation n drawn with unit length"""
+        return self.chord(self.axiom, self.chords(n, tree)[n], tree)[4]
+
+    def chord(self, s: str, table: dict[str, Chord], tree: bool = False) -> Chord:
+        """Compose the chords of the symbols of s"""
+        angle = sum(self.angle) / 2 if isinstance(self.angle, tuple) else self.angle
+        x = y = h = r = 0.0
+        d = 0
+        stack = []
+        for c in s:
+            if c in table or c in self.atoms:
+                dx, dy, dh, dd, cr = table.get(c, (1.0, 0.0, 0.0, 0, 1.0))
+                sc = 0.8 ** d if tree else 1
+                a = radians(h)
+                r = max(r, hypot(x, y) + sc * cr)
+                x += sc * (dx * cos(a) - dy * sin(a))
+                y += sc * (dx * sin(a) + dy * cos(a))
+                h += dh
+                d += dd
+            elif c == '+':
+                h += angle
+            elif c == '-':
+                h -= angle
+            elif c == '@' and tree:
+                d += 1
+            elif c == '[':
+                stack.append((x, y, h, d))
+            elif c == ']':
+                x, y, h, d = stack.pop()
+        return x, y, h, d, r
+
+    def digest(self) -> str:
+        """Hash of the parsed system that stays the same between runs"""
+        s = f'{sorted(self.atoms)} {self.angle} {self.axiom} {self.rules}'
+        return sha256(s.encode()).hexdigest()
+
+    def remember(self, n: int, state: str | tuple[np.ndarray, np.ndarray]):
+        """Cache a generation, evicting the biggest ones over the byte budget"""
+        size = sizeof(state)
+        if size > self.cache_size:
+            return
+        cached = {i: sizeof(s) for i, s in self.generations.items() if i}
+        total = sum(cached.values()) + size
+        for i in sorted(cached, key=cached.get, reverse=True):
+            if total <= self.cache_size:
+                break
+            total -= cached[i]
+            del self.generations[i]
+        self.generations[n] = state
+
+    def turns(self, codes: np.ndarray, seed: int | None = None) -> np.ndarray:
+        """Signed turn angle of every symbol; ranged angles are drawn in one call.
+
+        The same seed always gives the same angles.
+        """
+        plus = codes == ord('+')
+        minus = codes == ord('-')
+        turns = np.zeros(len(codes))
+        if isinstance(self.angle, tuple):
+            rng = np.random.default_rng(self.seed if seed is None else seed)
+            turns[plus | minus] = rng.uniform(*self.angle, np.count_nonzero(plus | minus))
+        else:
+            turns[plus | minus] = self.angle
+        turns[minus] *= -1
+        return turns
+
+    def angles(self, seed: int | None = None) -> 'Angles':
+        """Turn angles in the same order as turns() draws them, for streaming"""
+        return Angles(self.angle, self.seed if seed is None else seed)
+
+    def expand(self, n: int = 1) -> Iterator[str]:
+        """Lazily yield the symbols of the n-th generation.
+
+        The rewriting tree is walked depth-first, so memory use depends on n
+        and not on the length of the generation. Context-sensitive and
+        parametric systems are expanded in full instead and yield whole
+        modules such as 'F(2)'.
+        """
+        if not self.simple:
+            yield from Program.modules(*self.generate(n))
+            return
+        table = self.table
+        stack = [(iter(self.axiom), n)]
+        while stack:
+            letters, depth = stack[-1]
+            for letter in letters:
+                sub = table.get(ord(letter)) if depth else None
+                if sub is not None:
+                    stack.append((iter(sub), depth - 1))
+                    break
+                yield letter
+            else:
+                stack.pop()
+
+    def modules(self, n: int = 1) -> Iterator[tuple[str, float | None]]:
+        """Symbols of the n-th generation with their first parameter, or None.
+
+        Context-free systems without parameters are streamed as in expand.
+        """
+        if self.simple:
+            return zip(self.expand(n), repeat(None))
+        codes, params = self.generate(n)
+        return zip(map(chr, codes.tolist()), [None if p != p else p for p in params[:, 0].tolist()])
+
+
+def sizeof(state: str | tuple[np.ndarray, np.ndarray]) -> int:
+    """Bytes taken by a cached generation"""
+    return sum(map(sys.getsizeof, state)) if isinstance(state, tuple) else sys.getsizeof(state)
+
+
+class Angles:
+    """Stream of turn angles that can skip ahead without drawing.
+
+    Ranged angles come from one generator in the order LSystem.turns draws
+    them. skip(k) moves the generator past k angles in O(log k).
+    """
+    chunk: int = 4096  # углов за одно обращение к генератору
+
+    def __init__(self, angle: Angle, seed: int):
+        self.angle = angle
+        self.rng = np.random.default_rng(seed)
+        self.buffer = []
+        self.pos = 0
+        self.size = self.chunk  # размер следующей порции
+
+    def __iter__(self) -> 'Angles':
+        return self
+
+    def __next__(self) -> float:
+        if not isinstance(self.angle, tuple):
+            return self.angle
+        if self.pos == len(self.buffer):
+            self.buffer = self.rng.uniform(*self.angle, self.size).tolist()
+            self.size = min(2 * self.size, self.chunk)
+            self.pos = 0
+        self.pos += 1
+        return self.buffer[self.pos - 1]
+
+    def skip(self, k: int):
+        if not isinstance(self.angle, tuple):
+            return
+        left = len(self.buffer) - self.pos
+        if k <= left:
+            self.pos += k
+            return
+        # uniform берёт ровно одно 64-битное число на угол
+        self.rng.bit_generator.advance(k - left)
+        # после пропуска углы обычно снова скоро пропускаются, начинаем с малой порции
+        self.buffer, self.pos, self.size = [], 0, 16
+
+
+FUNCS = {'sqrt': np.sqrt, 'sin': np.sin, 'cos': np.cos, 'abs': np.abs, 'min': np.minimum, 'max': np.maximum}
+EXPR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Constant, ast.Name, ast.Load,
+              ast.Call, ast.operator, ast.unaryop, ast.cmpop)
+MODULE = re.compile(r'(.)(?:\(((?:[^()]|\([^()]*\))*)\))?')
+RULE = re.compile(r'^(?:(\S+)\s*<\s*)?(\S+?)(?:\s*>\s*(\S+))?$')
+
+
+def compile_expr(src: str):
+    """Compile an arithmetic expression that is evaluated on parameter arrays"""
+    tree = ast.parse(src.strip(), mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPR_NODES):
+            raise ValueError(f'Invalid expression: {src}')
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError(f'Chained comparison in {src}, use & instead')
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) not in FUNCS:
+            raise ValueError(f'Unknown function in {src}')
+    return compile(tree, '<rule>', 'eval')
+
+
+def parse_modules(s: str) -> list[tuple[str, list[str]]]:
+    """Split 'F(x*2,y)+A' into [('F', ['x*2', 'y']), ('+', []), ('A', [])]"""
+    return [(m[1], split_args(m[2]) if m[2] else []) for m in MODULE.finditer(s)]
+
+
+def split_args(s: str) -> list[str]:
+    """Split parameters at the commas that are not inside a function call"""
+    args, depth, start = [], 0, 0
+    for i, c in enumerate(s):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and not depth:
+            args.append(s[start:i].strip())
+            start = i + 1
+    return args + [s[start:].strip()]
+
+
+@dataclass
+class Rule:
+    pred: int  # код предшественника
+    left: int  # код левого контекста или -1
+    right: int  # код правого контекста или -1
+    names: tuple  # имена параметров левого контекста, предшественника и правого контекста
+    cond: object  # скомпилированное условие или None
+    succ: list[tuple[int, list]]  # коды преемника и выражения для их параметров
+
+
+@dataclass
+class Program:
+    """L-system rules lowered to integer symbol codes.
+
+    Supports context-sensitive rules 'L < A > R -> B' and parametric rules
+    'A(x,y) : x > 1 -> A(x/2,y)B(x+y)'. Every generation is rewritten as a
+    whole on NumPy arrays: codes, and a (k, width) array of parameters in
+    which NaN marks a missing one.
+    """
+    axiom: tuple[np.ndarray, np.ndarray]
+    rules: list[Rule]
+    ignore: np.ndarray  # символы, пропускаемые при поиске контекста
+    width: int  # наибольшее число параметров у модуля
+
+    @staticmethod
+    def compile(axiom: str, rules: list, ignore: str = '+-@') -> 'Program':
+        compiled = []
+        width = max((len(args) for _, args in parse_modules(axiom)), default=0)
+        for key, sub in rules:
+            pred, _, cond = key.partition(' : ')
+            m = RULE.match(pred.strip())
+            if m is None:
+                raise ValueError(f'Invalid rule: {key}')
+            names, codes = [], []
+            for part in m.groups():
+                modules = parse_modules(part) if part else [(None, [])]
+                if len(modules) != 1:
+                    raise ValueError(f'Invalid rule: {key}')
+                (sym, args), = modules
+                codes.append(ord(sym) if sym else -1)
+                names.append(tuple(args))
+                width = max(width, len(args))
+            succ = [(ord(sym), [compile_expr(expr) for expr in args]) for sym, args in parse_modules(sub)]
+            width = max([width, *(len(args) for _, args in succ)])
+            compiled.append(Rule(codes[1], codes[0], codes[2], tuple(names),
+                                 compile_expr(cond) if cond else None, succ))
+        width = max(width, 1)
+        return Program(Program.encode(axiom, width), compiled, codes_of(ignore), width)
+
+    @staticmethod
+    def encode(s: str, width: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        modules = parse_modules(s)
+        codes = np.array([ord(sym) for sym, _ in modules], dtype=np.uint32)
+        params = np.full((len(modules), width), np.nan)
+        for row, (_, args) in zip(params, modules):
+            row[:len(args)] = list(map(float, args))
+        return codes, params
+
+    @staticmethod
+    def decode(codes: np.ndarray, params: np.ndarray | None) -> str:
+        if params is None:
+            return codes.tobytes().decode('utf-32-le') if codes.dtype == np.uint32 else ''.join(map(chr, codes))
+        return ''.join(Program.modules(codes, params))
+
+    @staticmethod
+    def modules(codes: np.ndarray, params: np.ndarray) -> Iterator[str]:
+        """Every module as text, such as 'F(1,2)' or '+'"""
+        for c, row in zip(codes.tolist(), params.tolist()):
+            args = ','.join(f'{p:g}' for p in row if p == p)  # NaN != NaN
+            yield f'{chr(c)}({args})' if args else chr(c)
+
+    def context(self, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Index of the left and right context of every symbol, -1 if none.
+
+        Ignored symbols are skipped; the left context of a branch is the symbol
+        before its '[' and the right context skips whole branches and stops at ']'.
+        """
+        n = len(codes)
+        opens, closes = match_brackets(codes)
+        bracket = (codes == ord('[')) | (codes == ord(']'))
+        symbol = ~bracket & ~np.isin(codes, self.ignore)
+        i = np.arange(n)
+        # ячейка j + 1 соответствует символу j, ячейки 0 и n + 1 — «нет контекста»
+        cells = np.arange(n + 2)
+        left = cells - 1
+        left[0] = 0
+        left[i[symbol] + 1] = i[symbol] + 1
+        left[closes + 1] = opens
+        right = cells + 1
+        right[n + 1] = n + 1
+        right[i[symbol] + 1] = i[symbol] + 1
+        right[opens + 1] = closes + 2
+        right[closes + 1] = n + 1
+        for ptr in (left, right):
+            while True:
+                nxt = ptr[ptr]
+                if np.array_equal(nxt, ptr):
+                    break
+                ptr[:] = nxt
+        lc = left[i] - 1
+        rc = right[i + 2] - 1
+        return lc, np.where(rc == n, -1, rc)
+
+    def env(self, rule: Rule, idx: np.ndarray, params: np.ndarray, lc: np.ndarray, rc: np.ndarray) -> dict:
+        env = {'__builtins__': {}, **FUNCS}
+        for names, where in zip(rule.names, (lc, None, rc)):
+            rows = idx if where is None else where[idx]
+            for j, name in enumerate(names):
+                env[name] = params[rows, j]
+        return env
+
+    def step(self, codes: np.ndarray, params: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Rewrite one generation; the first matching rule wins"""
+        lc = rc = None
+        if any(r.left >= 0 or r.right >= 0 for r in self.rules):
+            lc, rc = self.context(codes)
+        rule = np.full(len(codes), -1)
+        for k, r in enumerate(self.rules):
+            m = (codes == r.pred) & (rule < 0)
+            if r.left >= 0:
+                m &= (lc >= 0) & (codes[lc] == r.left)
+            if r.right >= 0:
+                m &= (rc >= 0) & (codes[rc] == r.right)
+            if r.cond is not None and m.any():
+                idx = np.flatnonzero(m)
+                ok = np.broadcast_to(eval(r.cond, self.env(r, idx, params, lc, rc)), idx.shape)
+                m[idx[~ok]] = False
+            rule[m] = k
+
+        lengths = np.array([len(r.succ) for r in self.rules] + [1])
+        lens = lengths[rule]  # rule == -1 попадает в последнюю ячейку
+        starts = np.cumsum(lens) - lens
+        out = np.empty(lens.sum(), dtype=np.uint32)
+        out_params = np.full((len(out), self.width), np.nan)
+        keep = rule < 0
+        out[starts[keep]] = codes[keep]
+        out_params[starts[keep]] = params[keep]
+        for k, r in enumerate(self.rules):
+            idx = np.flatnonzero(rule == k)
+            if not len(idx):
+                continue
+            env = self.env(r, idx, params, lc, rc)
+            for j, (code, exprs) in enumerate(r.succ):
+                out[starts[idx] + j] = code
+                for q, expr in enumerate(exprs):
+                    out_params[starts[idx] + j, q] = eval(expr, env)
+        return out, out_params
+
+
+@dataclass
+class Geometry:
+    segs: np.ndarray  # (k, 4): x0, y0, x1, y1
+    widths: np.ndarray  # толщина пера
+    colors: np.ndarray  # (k, 3) uint8
+    depth: np.ndarray  # число @ над отрезком
+
+    def __len__(self) -> int:
+        return len(self.segs)
+
+    @cached_property
+    def bbox(self) -> tuple[float, float, float, float]:
+        if not len(self):
+            return 0, 0, 0, 0
+        xs = self.segs[:, 0::2]
+        ys = self.segs[:, 1::2]
+        return xs.min(), ys.min(), xs.max(), ys.max()
+
+    def fit(self, width: float, height: float, margin: float = 20) -> tuple[float, float, float]:
+        """Scale and offset that centre the bounding box in a width x height window"""
+        x0, y0, x1, y1 = self.bbox
+        scale = min((width - 2 * margin) / max(x1 - x0, 1e-9),
+                    (height - 2 * margin) / max(y1 - y0, 1e-9))
+        return scale, -scale * (x0 + x1) / 2, -scale * (y0 + y1) / 2
+
+
+def codes_of(state: str) -> np.ndarray:
+    """Symbol codes (code points) of a string"""
+    return np.frombuffer(state.encode('utf-32-le'), dtype=np.uint32)
+
+
+def match_brackets(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of matching '[' and ']', ordered by the closing bracket"""
+    pos = np.flatnonzero((codes == ord('[')) | (codes == ord(']')))
+    sign = np.where(codes[pos] == ord('['), 1, -1)
+    level = np.cumsum(sign)
+    if len(pos) and (level.min() < 0 or level[-1] != 0):
+        raise ValueError('Unbalanced brackets')
+    # уровень ']' считаем до закрытия, тогда на каждом уровне [ и ] чередуются
+    level[sign < 0] += 1
+    pairs = pos[np.argsort(level, kind='stable')].reshape(-1, 2)
+    pairs = pairs[np.argsort(pairs[:, 1])]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def scoped_cumsum(values: np.ndarray, opens: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    """Cumulative sum in which every ']' restores the value it had at its '['"""
+    s = np.cumsum(values)
+    if not len(closes):
+        return s
+    # после ']' сумма отстаёт от s на off плюс отставание на момент '['
+    off = s[closes] - s[opens]
+    parent = np.searchsorted(closes, opens) - 1
+    while (parent >= 0).any():  # pointer jumping по цепочкам скобок
+        valid = parent >= 0
+        off = off + np.where(valid, off[parent], 0)
+        parent = np.where(valid, parent[parent], -1)
+    last = np.searchsorted(closes, np.arange(len(values)), side='right') - 1
+    return s - np.where(last >= 0, off[last], 0)
+
+
+def interpret(lsystem: LSystem, state: str | np.ndarray, heading: float = 0,
+              ln: float = 1, tree: bool = False, pensz: float = 4,
+              col: Color = (0, 0, 0), seed: int | None = None,
+              params: np.ndarray | None = None, progress: Progress | None = None) -> Geometry:
+    """Turn an expanded L-system into segment arrays in one vectorized pass.
+
+    With tree=True every '@' shrinks the length and the pen and tints the
+    colour, as in Plotter.col_draw. Random angles come from the L-system seed
+    unless another seed is given. The first parameter of a forward symbol
+    scales its length and that of '+' or '-' replaces the angle. Progress is
+    reported between the stages of the pass.
+    """
+    return trace(lsystem, state, heading, ln, tree, pensz, col, seed, params, progress)[0]
+
+
+def trace(lsystem: LSystem, state: str | np.ndarray, heading: float = 0,
+          ln: float = 1, tree: bool = False, pensz: float = 4,
+          col: Color = (0, 0, 0), seed: int | None = None,
+          params: np.ndarray | None = None, progress: Progress | None = None) -> tuple[Geometry, Pose]:
+    """Like interpret, but also return where the turtle ends up"""
+    report = progress or (lambda f: None)
+    report(0)
+    codes = codes_of(state) if isinstance(state, str) else state
+    atoms = [ord(a) for a in lsystem.atoms if len(a) == 1]
+    fwd = np.isin(codes, atoms)
+    opens, closes = match_brackets(codes)
+    turns = lsystem.turns(codes, seed)
+    step = np.ones(len(codes))
+    if params is not None:
+        first = params[:, 0]
+        has = ~np.isnan(first)
+        turns = np.where(has & (codes == ord('+')), first, turns)
+        turns = np.where(has & (codes == ord('-')), -first, turns)
+        step = np.where(has, first, step)
+    report(0.2)
+    h = heading + scoped_cumsum(turns, opens, closes)
+    report(0.4)
+
+    depth = scoped_cumsum((codes == ord('@')).astype(np.int64), opens, closes)
+    k = depth[fwd]
+    step = np.where(fwd, step * (ln * 0.8 ** depth if tree else ln), 0)
+    dx = step * np.cos(np.radians(h))
+    dy = step * np.sin(np.radians(h))
+    report(0.6)
+    # положение после каждого символа; отрезок начинается там, где кончился предыдущий символ
+    x = np.concatenate(([0], scoped_cumsum(dx, opens, closes)))
+    y = np.concatenate(([0], scoped_cumsum(dy, opens, closes)))
+    report(0.8)
+    i = np.flatnonzero(fwd)
+    segs = np.column_stack((x[i], y[i], x[i + 1], y[i + 1]))
+
+    end = (x[-1], y[-1], h[-1], depth[-1]) if len(codes) else (0.0, 0.0, heading, 0)
+    return Geometry(segs, *pens(k, tree, pensz, col), k), end
+
+
+def pens(depth: np.ndarray, tree: bool, pensz: float, col: Color) -> tuple[np.ndarray, np.ndarray]:
+    """Pen widths and colours for segments at the given '@' depth"""
+    if not tree:
+        return np.ones(len(depth)), np.zeros((len(depth), 3), dtype=np.uint8)
+    # каждая @ осветляет цвет на 10 % с отбрасыванием дробной части, как делал Plotter.tint
+    table = [tuple(col)]
+    for _ in range(int(depth.max(initial=0))):
+        table.append(tuple(int(c + (255 - c) * 0.1) for c in table[-1]))
+    return pensz * 0.8 ** depth, np.array(table, dtype=np.uint8)[depth]
+
+
+def lod(lsystem: LSystem, n: int, scale: float, threshold: float = 1, heading: float = 0,
+        tree: bool = False, pensz: float = 4, col: Color = (0, 0, 0),
+        seed: int | None = None, limit: int | None = None,
+        progress: Progress | None = None) -> Geometry:
+    """Level-of-detail geometry of generation n for the given screen scale.
+
+    A subtree is not expanded once it fits in a circle of threshold pixels;
+    it is drawn as a single stroke along its chord instead, and the random
+    angles of its turns are skipped, so the rest of the plot draws the same
+    angles as interpret does whatever the scale. Dense systems
+    can still keep every segment, so with a limit OverBudget is raised as
+    soon as there are more segments than that.
+    """
+    chords = lsystem.chords(n, tree)
+    spins = lsystem.spins(n)
+    angles = lsystem.angles(seed)
+    x = y = 0.0
+    h = heading
+    d = 0
+    stack, segs, depth = [], [], []
+    todo = [(iter(enumerate(lsystem.axiom)), n, len(lsystem.axiom))]
+    at = []  # номер раскрытой буквы и длина строки на каждом уровне, для прогресса
+    while todo:
+        letters, k, size = todo[-1]
+        for i, c in letters:
+            sc = 0.8 ** d if tree else 1
+            if k and c in chords[k]:
+                dx, dy, dh, dd, r = chords[k][c]
+                if scale * sc * r >= threshold:
+                    sub = lsystem.table[ord(c)]
+                    at.append((i, size))
+                    todo.append((iter(enumerate(sub)), k - 1, len(sub)))
+                    break
+                # повороты свёрнутого поддерева всё равно берут свои углы из потока
+                angles.skip(spins[k][c])
+            elif c in lsystem.atoms:
+                dx, dy, dh, dd = 1.0, 0.0, 0.0, 0
+            else:
+                if c == '+':
+                    h += next(angles)
+                elif c == '-':
+                    h -= next(angles)
+                elif c == '@' and tree:
+                    d += 1
+                elif c == '[':
+                    stack.append((x, y, h, d))
+                elif c == ']':
+                    x, y, h, d = stack.pop()
+                continue
+            # отрезок или целое мелкое поддерево одним штрихом
+            a = radians(h)
+            nx = x + sc * (dx * cos(a) - dy * sin(a))
+            ny = y + sc * (dx * sin(a) + dy * cos(a))
+            if nx != x or ny != y:
+                segs.append((x, y, nx, ny))
+                depth.append(d)
+                if limit is not None and len(segs) > limit:
+                    raise OverBudget(f'N={n} keeps more than {limit} segments with level of detail')
+                if progress is not None and len(segs) % 4096 == 0:
+                    # считаем, что все буквы строки раскрываются в поддеревья одного размера
+                    done, weight = 0.0, 1.0
+                    for j, m in at:
+                        done += weight * j / m
+                        weight /= m
+                    progress(done)
+            x, y = nx, ny
+            h += dh
+            d += dd
+        else:
+            todo.pop()
+            if at:
+                at.pop()
+    segs = np.array(segs, dtype=float).reshape(-1, 4)
+    depth = np.array(depth, dtype=np.int64)
+    return Geometry(segs, *pens(depth, tree, pensz, col), depth)
+
+
+def subtrees(atoms: set, rules: list, angle: Angle, k: int, tree: bool,
+             tasks: list[tuple[str, int]]) -> list[tuple[np.ndarray, np.ndarray, Pose]]:
+    """Expand symbols k generations deep and trace each from the origin; runs in a worker process"""
+    parts = []
+    for c, seed in tasks:
+        lsystem = LSystem(atoms, c, rules, angle, seed)
+        geometry, end = trace(lsystem, lsystem.apply(k), tree=tree)
+        parts.append((geometry.segs, geometry.depth, end))
+    return parts
+
+
+def parallel(lsystem: LSystem, n: int, heading: float = 0, tree: bool = False, pensz: float = 4,
+             col: Color = (0, 0, 0), seed: int | None = None, jobs: int | None = None) -> Geometry:
+    """Geometry of generation n with independent subtrees built in a process pool.
+
+    The axiom is rewritten until it holds a few subtrees per process; every
+    subtree is then expanded and traced by a worker in its own frame, moved
+    into place and concatenated. Each subtree draws random angles from its
+    own seed, so they differ from the ones interpret would draw.
+    """
+    if not lsystem.simple:
+        raise ValueError('Only context-free systems can be expanded in parallel')
+    jobs = jobs or os.cpu_count() or 1
+    m = 0
+    while m < n and sum(v for c, v in lsystem.counts(m).items() if ord(c) in lsystem.table) < 4 * jobs:
+        m += 1
+    top = lsystem.apply(m)
+    seed = lsystem.seed if seed is None else seed
+    seeds = np.random.SeedSequence(seed).generate_state(len(top)).tolist()
+    tasks = [(c, s) for c, s in zip(top, seeds) if ord(c) in lsystem.table]
+    chunks = [tasks[i::jobs] for i in range(jobs)]
+    with ProcessPoolExecutor(jobs) as pool:
+        done = list(pool.map(partial(subtrees, lsystem.atoms, lsystem.rules, lsystem.angle, n - m, tree), chunks))
+    # обратно в порядок задач: i-я задача лежит в чанке i % jobs
+    parts = iter([done[i % jobs][i // jobs] for i in range(len(tasks))])
+
+    angles = lsystem.angles(seed)
+    x = y = 0.0
+    h = heading
+    d = 0
+    stack, segs, depth = [], [], []
+    for c in top:
+        sc = 0.8 ** d if tree else 1
+        a = radians(h)
+        if ord(c) in lsystem.table:
+            local, k, (ex, ey, eh, ed) = next(parts)
+            rot = sc * np.array([[cos(a), sin(a)], [-sin(a), cos(a)]])
+            segs.append((local.reshape(-1, 2) @ rot + (x, y)).reshape(-1, 4))
+            depth.append(k + d)
+        elif c in lsystem.atoms:
+            ex, ey, eh, ed = 1.0, 0.0, 0.0, 0
+            segs.append(np.array([[x, y, x + sc * cos(a), y + sc * sin(a)]]))
+            depth.append(np.array([d]))
+        else:
+            if c == '+':
+                h += next(angles)
+            elif c == '-':
+                h -= next(angles)
+            elif c == '@':
+                d += 1
+            elif c == '[':
+                stack.append((x, y, h, d))
+            elif c == ']':
+                x, y, h, d = stack.pop()
+            continue
+        x += sc * (ex * cos(a) - ey * sin(a))
+        y += sc * (ex * sin(a) + ey * cos(a))
+        h += eh
+        d += ed
+    segs = np.concatenate(segs) if segs else np.empty((0, 4))
+    depth = np.concatenate(depth) if depth else np.empty(0, dtype=np.int64)
+    return Geometry(segs, *pens(depth, tree, pensz, col), depth)
+
+
+def hex_color(c) -> str:
+    return '#%02x%02x%02x' % tuple(c)
+
+
+def to_pixels(segs: np.ndarray, width: int, height: int, scale: float, x: float, y: float) -> np.ndarray:
+    """Segments in image coordinates: origin in the centre, y pointing down"""
+    segs = segs * scale
+    segs[:, 0::2] += x + width / 2
+    segs[:, 1::2] = height / 2 - y - segs[:, 1::2]
+    return segs
+
+
+def clip(segs: np.ndarray, x0: float, y0: float, x1: float, y1: float) -> tuple[np.ndarray, np.ndarray]:
+    """Segments cut to a rectangle (Liang-Barsky) and the indices of the ones that touch it"""
+    d = segs[:, 2:] - segs[:, :2]
+    lo = np.zeros(len(segs))
+    hi = np.ones(len(segs))
+    keep = np.ones(len(segs), dtype=bool)
+    for axis, (a, b) in enumerate(((x0, x1), (y0, y1))):
+        start, delta = segs[:, axis], d[:, axis]
+        flat = delta == 0
+        # отрезок, параллельный стороне, либо целиком внутри полосы, либо снаружи
+        keep &= ~flat | ((start >= a) & (start <= b))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ta = (a - start) / delta
+            tb = (b - start) / delta
+        lo = np.where(flat, lo, np.maximum(lo, np.minimum(ta, tb)))
+        hi = np.where(flat, hi, np.minimum(hi, np.maximum(ta, tb)))
+    i = np.flatnonzero(keep & (lo <= hi))
+    return np.column_stack((segs[i, :2] + lo[i, None] * d[i], segs[i, :2] + hi[i, None] * d[i])), i
+
+
+def rasterize(geometry: Geometry, width: int, height: int, scale: float = 1,
+              x: float = 0, y: float = 0, bg: Color = (255, 255, 255)) -> np.ndarray:
+    """Draw the segments into a (height, width, 3) image centred on (0, 0).
+
+    Segments are clipped to the image first, so points are only made for
+    the part of the plot that can be seen.
+    """
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = bg
+    radius = np.rint(geometry.widths / 2).astype(np.int64)
+    pad = int(radius.max(initial=0)) + 1  # перо заходит в картинку и из-за края
+    segs, live = clip(to_pixels(geometry.segs, width, height, scale, x, y),
+                      -pad, -pad, width - 1 + pad, height - 1 + pad)
+    # по точке на каждый пиксель длины отрезка, но не больше диагонали картинки
+    most = int(np.ceil(np.hypot(width + 2 * pad, height + 2 * pad))) + 1
+    count = np.ceil(np.hypot(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1])).astype(np.int64) + 1
+    count = np.minimum(count, most)
+    idx = np.repeat(np.arange(len(segs)), count)
+    t_ = np.arange(len(idx)) - np.repeat(np.cumsum(count) - count, count)
+    t_ = t_ / np.repeat(np.maximum(count - 1, 1), count)
+    px = segs[idx, 0] + (segs[idx, 2] - segs[idx, 0]) * t_
+    py = segs[idx, 1] + (segs[idx, 3] - segs[idx, 1]) * t_
+    idx = live[idx]
+    radius = radius[idx]
+    for r in np.unique(radius):
+        sel = radius == r
+        for ox in range(-r, r + 1):
+            for oy in range(-r, r + 1):
+                if ox * ox + oy * oy > r * r:
+                    continue
+                ix = np.rint(px[sel] + ox).astype(np.int64)
+                iy = np.rint(py[sel] + oy).astype(np.int64)
+                inside = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+                img[iy[inside], ix[inside]] = geometry.colors[idx[sel][inside]]
+    return img
+
+
+def write_png(path: str, img: np.ndarray):
+    """Save an RGB uint8 image as PNG"""
+    h, w, _ = img.shape
+    raw = np.empty((h, w * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0  # фильтр None для каждой строки
+    raw[:, 1:] = img.reshape(h, -1)
+    with open(path, 'wb') as f:
+        f.write(SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)))
+        f.write(png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def write_svg(path: str, geometry: Geometry, width: int, height: int, scale: float = 1,
+              x: float = 0, y: float = 0, bg: Color = (255, 255, 255)):
+    """Save the segments as SVG polylines, one per run of connected segments"""
+    segs = to_pixels(geometry.segs, width, height, scale, x, y)
+    runs = Renderer.runs(geometry)
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">\n')
+        f.write(f'<rect width="100%" height="100%" fill="{hex_color(bg)}"/>\n')
+        for a, b in zip(runs, np.append(runs[1:], len(segs))):
+            points = np.vstack((segs[a, :2], segs[a:b, 2:]))
+            coords = ' '.join(f'{px:.2f},{py:.2f}' for px, py in points)
+            f.write(f'<polyline points="{coords}" fill="none" stroke="{hex_color(geometry.colors[a])}" '
+                    f'stroke-width="{geometry.widths[a]:.2f}" stroke-linecap="round"/>\n')
+        f.write('</svg>\n')
+
+
+class Store:
+    """On-disk cache of expanded generations and their geometry.
+
+    Arrays are saved as .npy files under a hash of the L-system, the
+    generation and the seed and read back memory-mapped, so reopening a
+    heavy fractal costs a lookup instead of an expansion. Entries that were
+    used least recently are deleted once the cache outgrows size bytes.
+    """
+    size: int = 2**30  # бюджет кэша на диске в байтах
+    total: int | None  # занято на диске по подсчёту этого процесса, None — ещё не считали
+
+    def __init__(self, root: str, size: int | None = None):
+        self.root = root
+        self.total = None
+        if size is not None:
+            self.size = size
+
+    @staticmethod
+    def default() -> str:
+        return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'task1ab')
+
+    def path(self, key: tuple, name: str) -> str:
+        return os.path.join(self.root, sha256(repr(key).encode()).hexdigest()[:32], name + '.npy')
+
+    def load(self, key: tuple, name: str) -> np.ndarray | None:
+        path = self.path(key, name)
+        try:
+            a = np.load(path, mmap_mode='r')
+            os.utime(os.path.dirname(path))  # время доступа для вытеснения
+            return a
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: tuple, **arrays: np.ndarray):
+        if self.total is None:
+            self.total = sum(size for _, size, _ in self.entries())
+        for name, a in arrays.items():
+            path = self.path(key, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # пишем во временный файл, чтобы другой процесс не прочёл его наполовину
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, a)
+            self.total += os.path.getsize(tmp)
+            if os.path.exists(path):
+                self.total -= os.path.getsize(path)
+            os.replace(tmp, path)
+        # каталог обходим, только когда кэш по подсчёту вышел за бюджет
+        if self.total > self.size:
+            self.evict(os.path.dirname(self.path(key, '')))
+
+    def evict(self, keep: str):
+        """Delete the least recently used entries over the byte budget, except keep"""
+        entries = self.entries()
+        self.total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.total <= self.size:
+                break
+            if path != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                self.total -= size
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """Last use, size in bytes and directory of every entry"""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:  # запись удалил другой процесс
+                    continue
+        return entries
+
+    def generate(self, lsystem: LSystem, n: int,
+                 progress: Progress | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+        """LSystem.generate through the cache"""
+        key = (lsystem.digest(), n)
+        codes = self.load(key, 'codes')
+        if codes is not None:
+            return codes, None if lsystem.simple else self.load(key, 'params')
+        codes, params = lsystem.generate(n, progress)
+        # параметры пишем первыми: поколение считается сохранённым, когда есть codes
+        if params is not None:
+            self.save(key, params=params)
+        self.save(key, codes=codes)
+        return codes, params
+
+    def geometry(self, lsystem: LSystem, n: int, heading: float = 0, tree: bool = False,
+                 pensz: float = 4, col: Color = (0, 0, 0), seed: int | None = None,
+                 progress: Progress | None = None) -> Geometry:
+        """Unit-length interpret of generation n through the cache"""
+        # без случайных углов геометрия от зерна не зависит
+        random = isinstance(lsystem.angle, tuple)
+        key = (lsystem.digest(), n, heading, tree, (lsystem.seed if seed is None else seed) if random else None)
+        depth = self.load(key, 'depth')
+        segs = self.load(key, 'segs')
+        if depth is None or segs is None:
+            codes, params = self.generate(lsystem, n, None if progress is None else lambda f: progress(0.8 * f))
+            geometry = interpret(lsystem, codes, heading, 1, tree, pensz, col, seed, params,
+                                 None if progress is None else lambda f: progress(0.8 + 0.2 * f))
+            if progress is not None:
+                progress(1)  # отменённая сборка не пишет на диск
+            self.save(key, segs=geometry.segs, depth=geometry.depth)
+            return geometry
+        return Geometry(segs, *pens(depth, tree, pensz, col), depth)
+
+
+class Renderer:
+    """Draws Geometry on a canvas in large batches instead of turtle steps.
+
+    Connected runs of segments with the same pen become one polyline; when
+    there are too many runs or too many vertices the plot is rasterized into
+    a single PhotoImage. Long runs are split so that no step draws more than
+    span segments.
+    """
+    TAG = 'lsystem'
+    max_lines: int = 5000  # больше полилиний рисуем картинкой
+    max_points: int = 100000  # больше вершин рисуем картинкой
+    batch: int = 500  # полилиний за один шаг
+    span: int = 5000  # отрезков в одной полилинии
+
+    def __init__(self, canvas: tk.Canvas, bg: Color = (255, 255, 255)):
+        self.canvas = canvas
+        self.bg = bg
+        self.image = None
+        self.geometry = None
+        self.view = (1, 0, 0)
+
+    def clear(self):
+        self.canvas.delete(self.TAG)
+        self.image = None
+        self.geometry = None
+
+    def draw(self, geometry: Geometry, scale: float = 1, x: float = 0, y: float = 0):
+        for _ in self.steps(geometry, scale, x, y):
+            pass
+
+    def steps(self, geometry: Geometry, scale: float = 1, x: float = 0, y: float = 0) -> Iterator:
+        """Draw step by step, yielding after every batch of polylines"""
+        if geometry is self.geometry and self.image is None:
+            self.move(scale, x, y)
+            return
+        self.clear()
+        if len(geometry):
+            runs = self.runs(geometry)
+            if len(runs) > self.max_lines or len(geometry) + len(runs) > self.max_points:
+                self.draw_image(geometry, scale, x, y)
+            else:
+                yield from self.draw_lines(geometry, runs, scale, x, y)
+        # недорисованную картинку нельзя двигать, поэтому запоминаем только в конце
+        self.geometry = geometry
+        self.view = (scale, x, y)
+
+    def move(self, scale: float, x: float, y: float):
+        """Change the view of the polylines already on the canvas"""
+        s0, x0, y0 = self.view
+        r = scale / s0
+        self.canvas.scale(self.TAG, 0, 0, r, r)
+        self.canvas.move(self.TAG, x - r * x0, r * y0 - y)
+        self.view = (scale, x, y)
+
+    @staticmethod
+    def runs(geometry: Geometry) -> np.ndarray:
+        """Start indices of runs of connected segments drawn with the same pen"""
+        segs = geometry.segs
+        brk = np.ones(len(segs), dtype=bool)
+        brk[1:] = ((segs[1:, :2] != segs[:-1, 2:]).any(axis=1)
+                   | (geometry.widths[1:] != geometry.widths[:-1])
+                   | (geometry.colors[1:] != geometry.colors[:-1]).any(axis=1))
+        return np.flatnonzero(brk)
+
+    def draw_lines(self, geometry: Geometry, runs: np.ndarray, scale: float, x: float, y: float) -> Iterator:
+        segs = geometry.segs * scale
+        segs[:, 0::2] += x
+        segs[:, 1::2] = -(segs[:, 1::2] + y)  # ось y холста направлена вниз
+        # длинные серии режем на куски, чтобы каждый шаг оставался коротким
+        ends = np.append(runs[1:], len(segs))
+        runs = np.concatenate([np.arange(a, b, self.span) for a, b in zip(runs, ends)])
+        # вершины полилиний: начало первого отрезка серии и концы всех отрезков
+        points = np.insert(segs[:, 2:], runs, segs[runs, :2], axis=0)
+        bounds = runs + np.arange(len(runs))
+        for j, (i, coords) in enumerate(zip(runs, np.split(points, bounds[1:])), 1):
+            self.canvas.create_line(coords.ravel().tolist(), tags=self.TAG,
+                                    fill=hex_color(geometry.colors[i]),
+                                    width=geometry.widths[i])
+            if j % self.batch == 0 or len(coords) > self.span:
+                yield
+
+    def draw_image(self, geometry: Geometry, scale: float, x: float, y: float):
+        w = self.canvas.winfo_width()
+        h = self.canvas.winfo_height()
+        # видимая область холста; начало координат turtle — точка (0, 0) холста
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        img = rasterize(geometry, w, h, scale, x - left - w / 2, y + top + h / 2, self.bg)
+        ppm = b'P6 %d %d 255\n' % (w, h) + img.tobytes()
+        self.image = tk.PhotoImage(data=ppm, format='PPM')
+        self.canvas.create_image(left, top, image=self.image, anchor=tk.NW, tags=self.TAG)
+
+
+class Worker(threading.Thread):
+    """Runs build(report) off the Tk thread.
+
+    build should call report(fraction) now and then; once the worker is
+    cancelled report raises Cancelled and the result is dropped.
+    """
+    def __init__(self, build: Callable[[Progress], object]):
+        super().__init__(daemon=True)
+        self.build = build
+        self.cancelled = threading.Event()
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+
+    def report(self, fraction: float):
+        if self.cancelled.is_set():
+            raise Cancelled
+        self.progress = fraction
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            self.result = self.build(self.report)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
+
+class Scheduler:
+    """Coalesces bursts of redraw requests and runs only the latest one.
+
+    A job is a generator function; it is advanced in time slices from after()
+    so the window stays responsive, and a new request cancels it. A job may
+    yield a number of milliseconds to sleep before its next step.
+    """
+    delay: int = 40  # мс тишины перед перерисовкой
+    budget: float = 0.03  # секунд работы за один срез
+
+    def __init__(self, widget: tk.Misc):
+        self.widget = widget
+        self.pending = None
+        self.job = None
+
+    def request(self, job: Callable[[], Iterator], delay: int | None = None):
+        self.cancel()
+        self.pending = self.widget.after(self.delay if delay is None else delay, self.start, job)
+
+    def cancel(self):
+        if self.pending is not None:
+            self.widget.after_cancel(self.pending)
+            self.pending = None
+        if self.job is not None:
+            self.job.close()
+            self.job = None
+
+    def start(self, job: Callable[[], Iterator]):
+        self.job = job()
+        self.step()
+
+    def step(self):
+        self.pending = None
+        deadline = perf_counter() + self.budget
+        try:
+            wait = next(self.job)
+            while not wait and perf_counter() < deadline:
+                wait = next(self.job)
+        except StopIteration:
+            self.job = None
+            return
+        self.pending = self.widget.after(wait or 1, self.step)
 
 
 class Plotter(t.Turtle):
@@ -73,16 +1222,25 @@ class Plotter(t.Turtle):
     lsystem: LSystem
     win: tk.Toplevel | tk.Tk
     canvas: t.TurtleScreen
-    stack: list[tuple]
+    renderer: Renderer
+    scheduler: Scheduler
+    geometries: dict[tuple, Geometry]
+    stack: list[tuple]  # (x, y, heading) веток в draw
+    branches: np.ndarray  # ветки col_draw, записи BRANCH
     ln: int = 10
     x: int = 0
     y: int = 0
     n: int = 1
     col: Color = (0, 0, 0)
     pensz: int = 4
+    budget: int = 2**30  # байт на построение одного поколения
+    time_budget: float = 10  # секунд на построение одного поколения
+    detail: float = 1  # поддеревья мельче стольких пикселей рисуем одним штрихом
+    preview: int = 256  # размер грубого чертежа для подгонки под окно, в пикселях
 
-    def __init__(self, lsystem: LSystem, angle: int = 0):
+    def __init__(self, lsystem: LSystem, angle: int = 0, store: Store | None = None):
         self.lsystem = lsystem
+        self.store = store
         super().__init__()
         self.stack = []
         self.sc = t.Screen()
@@ -91,14 +1249,28 @@ class Plotter(t.Turtle):
         self.speed(0)
         self.ANGLE = angle
         self.rts = tk.BooleanVar(value=True)
+        self.slow = tk.BooleanVar(value=False)
+        self.fit = tk.BooleanVar(value=True)
+        self.lod = tk.BooleanVar(value=False)
+        self.geometries = {}
+        self.renderer = Renderer(self.sc.getcanvas(), (255, 250, 205))
         self.win = self.sc.getcanvas().winfo_toplevel()
+        self.scheduler = Scheduler(self.win)
         self.bbox = tk.Frame(self.win)
         self.button1 = tk.Button(self.bbox, text='Sketch', command=self.sketch, width=30)
         self.button2 = tk.Button(self.bbox, text='Clear', command=self.clear, width=30)
         self.button3 = tk.Button(self.bbox, text='Render', command=self.render, width=30)
         self.check = tk.Checkbutton(self.bbox, text='Real-time sketching',
                                     variable=self.rts, onvalue=True, offvalue=False)
+        self.check2 = tk.Checkbutton(self.bbox, text='Turtle drawing', command=self.sketch,
+                                     variable=self.slow, onvalue=True, offvalue=False)
+        self.status = tk.Label(self.bbox, text='')
+        self.check3 = tk.Checkbutton(self.bbox, text='Fit to window', command=self.refresh,
+                                     variable=self.fit, onvalue=True, offvalue=False)
+        self.check4 = tk.Checkbutton(self.bbox, text='Level of detail', command=self.refresh,
+                                     variable=self.lod, onvalue=True, offvalue=False)
         self.button4 = tk.Button(self.bbox, text='+90°', command=self.rotate, height=6)
+        self.button5 = tk.Button(self.bbox, text='Reseed', command=self.reseed, width=30)
         self.scale1 = tk.Scale(self.win, from_=-1000, to=1000, orient=tk.HORIZONTAL, command=self.set_x, label='X')
         self.scale2 = tk.Scale(self.win, from_=-1000, to=1000, orient=tk.VERTICAL, command=self.set_y, label='Y')
         self.scale3 = tk.Scale(self.win, from_=0, to=13, orient=tk.HORIZONTAL, command=self.set_n, label='N')
@@ -108,7 +1280,12 @@ class Plotter(t.Turtle):
         self.button1.pack(padx=5)
         self.button2.pack(padx=5)
         self.button3.pack(padx=5)
+        self.button5.pack(padx=5)
         self.check.pack(padx=5)
+        self.check2.pack(padx=5)
+        self.check3.pack(padx=5)
+        self.check4.pack(padx=5)
+        self.status.pack(padx=5)
         self.scale2.pack(side=tk.RIGHT)
         self.scale1.pack(side=tk.RIGHT)
         self.scale4.pack(side=tk.RIGHT)
@@ -119,25 +1296,23 @@ class Plotter(t.Turtle):
         self.scale4.set(self.ln)
         t.done()
 
-    def draw(self):
+    def draw(self) -> Iterator:
         self.position()
-        state = self.lsystem.apply(self.n)
+        self.stack = []
+        state = self.lsystem.modules(self.n)
+        angles = self.lsystem.angles()
 
-        for atom in state:
+        # параметр задаёт длину шага или угол, как в interpret; случайный угол всё равно берётся
+        for atom, p in state:
             if atom in self.lsystem.atoms:
-                self.forward(self.ln)
+                self.forward(self.ln if p is None else self.ln * p)
+                yield
             elif atom == '+':
-                if isinstance(self.lsystem.angle, tuple):
-                    angle = randint(*self.lsystem.angle)
-                else:
-                    angle = self.lsystem.angle
-                self.left(angle)
+                a = next(angles)
+                self.left(a if p is None else p)
             elif atom == '-':
-                if isinstance(self.lsystem.angle, tuple):
-                    angle = randint(*self.lsystem.angle)
-                else:
-                    angle = self.lsystem.angle
-                self.right(angle)
+                a = next(angles)
+                self.right(a if p is None else p)
             elif atom == '[':
                 self.stack.append((self.xcor(), self.ycor(), self.heading()))
             elif atom == ']':
@@ -147,62 +1322,166 @@ class Plotter(t.Turtle):
                 self.setheading(h)
                 self.pendown()
 
-    def tint(self, c: Color, _t: float) -> Color:
-        """Tint a color by a factor of t, where 0 <= t <= 1"""
-        r = int(c[0] + (255 - c[0]) * _t)
-        g = int(c[1] + (255 - c[1]) * _t)
-        b = int(c[2] + (255 - c[2]) * _t)
-        return (r, g, b)
-
-    def col_draw(self):
+    def col_draw(self) -> Iterator:
         self.position()
-        state = self.lsystem.apply(self.n)
-        col = self.col
-        pw = self.pensz
-        ln = self.ln
-
-        self.pensize(pw)
-        self.pencolor(col)
-        for atom in state:
+        # состояние ветки в заранее выделенном массиве, цвет и толщина берутся по глубине
+        self.branches = np.empty(64, dtype=BRANCH)
+        top = d = 0
+        state = self.lsystem.modules(self.n)
+        angles = self.lsystem.angles()
+        widths, colors, lengths = self.palette(64)
+
+        self.pensize(widths[0])
+        self.pencolor(colors[0])
+        for atom, p in state:
             if atom in self.lsystem.atoms:
-                self.forward(ln)
+                self.forward(lengths[d] if p is None else lengths[d] * p)
+                yield
             elif atom == '+':
-                if isinstance(self.lsystem.angle, tuple):
-                    angle = randint(*self.lsystem.angle)
-                else:
-                    angle = self.lsystem.angle
-                self.left(angle)
+                a = next(angles)
+                self.left(a if p is None else p)
             elif atom == '-':
-                if isinstance(self.lsystem.angle, tuple):
-                    angle = randint(*self.lsystem.angle)
-                else:
-                    angle = self.lsystem.angle
-                self.right(angle)
+                a = next(angles)
+                self.right(a if p is None else p)
             elif atom == '[':
-                self.stack.append((self.xcor(), self.ycor(), self.heading(), col, pw, ln))
+                if top == len(self.branches):
+                    self.branches = np.concatenate((self.branches, np.empty_like(self.branches)))
+                self.branches[top] = self.xcor(), self.ycor(), self.heading(), d
+                top += 1
             elif atom == ']':
-                x, y, h, col, pw, ln = self.stack.pop()
+                top -= 1
+                x, y, h, d = self.branches[top]
                 self.penup()
                 self.goto(x, y)
                 self.setheading(h)
-                self.pensize(pw)
-                self.pencolor(col)
+                self.pensize(widths[d])
+                self.pencolor(colors[d])
                 self.pendown()
             elif atom == '@':
-                pw *= 0.8
-                ln *= 0.8
-                col = self.tint(col, 0.1)
-                self.pensize(pw)
-                self.pencolor(col)
+                d += 1
+                if d == len(widths):
+                    widths, colors, lengths = self.palette(2 * d)
+                self.pensize(widths[d])
+                self.pencolor(colors[d])
 
-    def rotate(self):
+    def palette(self, n: int) -> tuple[list[float], list[str], list[float]]:
+        """Pen widths, colours and step lengths for '@' depths below n"""
+        depth = np.arange(n)
+        widths, colors = pens(depth, True, self.pensz, self.col)
+        return widths.tolist(), [hex_color(c) for c in colors], (self.ln * 0.8 ** depth).tolist()
+
+    def build(self, n: int, angle: int, tree: bool, seed: int, report: Progress) -> Geometry:
+        """Unit-length geometry of generation n; runs in a worker thread"""
+        if self.store is not None:
+            return self.store.geometry(self.lsystem, n, angle, tree, self.pensz, self.col, seed, report)
+        codes, params = self.lsystem.generate(n, lambda f: report(0.8 * f))
+        return interpret(self.lsystem, codes, angle, 1, tree, self.pensz, self.col, seed, params,
+                         lambda f: report(0.8 + 0.2 * f))
+
+    def build_lod(self, n: int, angle: int, tree: bool, seed: int, scale: float, report: Progress) -> Geometry:
+        """Level-of-detail geometry of generation n at the given scale; runs in a worker thread"""
+        report(0)
+        # пока поколение целиком помещается в бюджет, детализация его не превысит
+        affordable = self.lsystem.affordable(n, self.budget, self.time_budget)
+        limit = None if affordable else self.lsystem.limit(self.budget, self.time_budget)
+        return lod(self.lsystem, n, scale, self.detail, angle, tree, self.pensz, self.col, seed, limit, report)
+
+    def geometry(self, tree: bool = False, scale: float | None = None) -> Iterator:
+        """Get the geometry of the current generation, building it in the background.
+
+        With a scale the geometry is built with level of detail for that scale.
+        Yields while the worker runs; the geometry is the return value.
+        """
+        # поколение не по бюджету заменяем самым большим, что помещается
+        n = self.lsystem.fitting(self.n, self.budget, self.time_budget) if scale is None else self.n
+        while True:
+            note = f'N={self.n} is over the memory or time budget, showing N={n}' if n < self.n else ''
+            if scale is None:
+                key = (n, self.ANGLE, tree, self.lsystem.seed)
+                build = self.build
+            else:
+                key = (n, self.ANGLE, tree, self.lsystem.seed, scale)
+                build = self.build_lod
+            try:
+                return (yield from self.built(key, build, note))
+            except OverBudget:
+                # детализация не ограничила число отрезков, уменьшаем поколение
+                n = min(n - 1, self.lsystem.fitting(n, self.budget, self.time_budget))
+
+    def built(self, key: tuple, build: Callable, note: str) -> Iterator:
+        """Get build(*key) from the cache or from a worker, yielding while it runs"""
+        if key not in self.geometries:
+            worker = Worker(partial(build, *key))
+            worker.start()
+            try:
+                while worker.is_alive():
+                    self.status.config(text=f'Building N={key[0]}: {worker.progress:.0%}')
+                    yield 50
+            finally:
+                worker.cancel()
+                self.status.config(text=note)
+            if worker.error is not None:
+                raise worker.error
+            if len(self.geometries) > 1:
+                del self.geometries[next(iter(self.geometries))]
+            self.geometries[key] = worker.result
+        self.status.config(text=note)
+        return self.geometries[key]
+
+    def view(self, geometry: Geometry) -> tuple[float, float, float]:
+        """Scale and offset of the geometry; with fitting the sliders are relative to the fit"""
+        if not self.fit.get():
+            return self.ln, self.x, self.y
+        canvas = self.sc.getcanvas()
+        scale, x, y = geometry.fit(canvas.winfo_width(), canvas.winfo_height())
+        return scale * self.ln / Plotter.ln, x + self.x, y + self.y
+
+    def detailed(self, tree: bool = False) -> Iterator:
+        """Get level-of-detail geometry for the current view and the view itself.
+
+        With fitting the view is taken from a coarse preview of the plot.
+        """
+        if self.fit.get():
+            # весь чертёж лежит в круге радиуса radius, так что масштаб подгонки не меньше этого
+            scale = self.preview / max(2 * self.lsystem.radius(self.n, tree), 1e-9)
+            view = self.view((yield from self.geometry(tree, scale)))
+        else:
+            view = self.ln, self.x, self.y
+        geometry = yield from self.geometry(tree, view[0])
+        return geometry, view
+
+    def plot(self, tree: bool = False) -> Iterator:
+        """Draw the current generation step by step, turtle by turtle or in batches"""
         self.sc.tracer(False)
+        try:
+            if self.slow.get():
+                self.clear()
+                yield from self.col_draw() if tree else self.draw()
+            elif self.lod.get() and self.lsystem.simple:
+                geometry, view = yield from self.detailed(tree)
+                yield from self.renderer.steps(geometry, *view)
+            else:
+                geometry = yield from self.geometry(tree)
+                yield from self.renderer.steps(geometry, *self.view(geometry))
+        finally:
+            self.sc.tracer(True)
+
+    def refresh(self):
+        if self.rts.get():
+            self.scheduler.request(self.plot)
+        else:
+            self.scheduler.cancel()
+            self.clear()
+
+    def reseed(self):
+        self.lsystem.seed = getrandbits(32)
+        self.geometries.clear()
+        self.refresh()
+
+    def rotate(self):
         self.ANGLE += 90
         self.ANGLE %= 360
-        self.clear()
-        if self.rts.get():
-            self.draw()
-        self.sc.tracer(True)
+        self.refresh()
 
     def position(self):
         self.penup()
@@ -211,59 +1490,116 @@ class Plotter(t.Turtle):
         self.pendown()
 
     def sketch(self):
-        self.sc.tracer(False)
+        self.scheduler.cancel()
         self.clear()
-        self.draw()
-        self.sc.tracer(True)
+        self.scheduler.request(self.plot, 0)
 
     def render(self):
-        self.sc.tracer(False)
+        self.scheduler.cancel()
         self.clear()
-        self.col_draw()
-        self.sc.tracer(True)
+        self.scheduler.request(lambda: self.plot(tree=True), 0)
 
     def clear(self):
+        self.renderer.clear()
         self.reset()
 
     def set_ln(self, value):
-        self.sc.tracer(False)
         self.ln = int(value)
-        self.clear()
-        if self.rts.get():
-            self.draw()
-        self.sc.tracer(True)
+        self.refresh()
 
     def set_x(self, value):
-        self.sc.tracer(False)
         self.x = int(value)
-        self.clear()
-        if self.rts.get():
-            self.draw()
-        self.sc.tracer(True)
+        self.refresh()
 
     def set_y(self, value):
-        self.sc.tracer(False)
         self.y = int(value)
-        self.clear()
-        if self.rts.get():
-            self.draw()
-        self.sc.tracer(True)
+        self.refresh()
 
     def set_n(self, value):
-        self.sc.tracer(False)
         self.n = int(value)
-        if self.n > 9:
-            self.rts.set(False)
-        self.clear()
-        if self.rts.get():
-            self.draw()
-        self.sc.tracer(True)
+        self.refresh()
+
+
+def export(lsystem: LSystem, n: int, path: str, width: int, height: int, angle: int = 0,
+           tree: bool = False, seed: int | None = None, detail: float | None = None,
+           jobs: int | None = None, store: Store | None = None,
+           limit: int | None = None) -> tuple[int, float]:
+    """Render generation n to an SVG or PNG file without a display.
+
+    With detail, subtrees smaller than that many pixels are drawn as single
+    strokes, and OverBudget is raised if more than limit segments are left;
+    with jobs, subtrees are built by that many processes, 0 for all cores.
+    A store caches the full-detail geometry between runs.
+    Returns the number of segments and the time it took.
+    """
+    start = perf_counter()
+    if jobs is not None and detail is None and lsystem.simple:
+        geometry = parallel(lsystem, n, angle, tree, Plotter.pensz, Plotter.col, seed, jobs)
+    elif detail is None and store is not None:
+        geometry = store.geometry(lsystem, n, angle, tree, Plotter.pensz, Plotter.col, seed)
+    elif detail is None:
+        codes, params = lsystem.generate(n)
+        geometry = interpret(lsystem, codes, angle, 1, tree, Plotter.pensz, Plotter.col, seed, params)
+    else:
+        scale = min(width, height) / max(2 * lsystem.radius(n, tree), 1e-9)
+        preview = lod(lsystem, n, scale, detail, angle, tree, seed=seed, limit=limit)
+        scale = preview.fit(width, height)[0]
+        geometry = lod(lsystem, n, scale, detail, angle, tree, Plotter.pensz, Plotter.col, seed, limit)
+    scale, x, y = geometry.fit(width, height)
+    bg = (255, 250, 205)
+    if path.lower().endswith('.svg'):
+        write_svg(path, geometry, width, height, scale, x, y, bg)
+    else:
+        write_png(path, rasterize(geometry, width, height, scale, x, y, bg))
+    return len(geometry), perf_counter() - start
 
 
 def main():
-    with open('task1a.txt', 'r', encoding='utf8') as f:
+    parser = argparse.ArgumentParser(description='L-system plotter')
+    parser.add_argument('file', nargs='?', default='task1a.txt', help='L-system description')
+    parser.add_argument('-n', type=int, default=Plotter.n, help='generation')
+    parser.add_argument('-a', '--angle', type=int, default=0, help='initial heading in degrees')
+    parser.add_argument('-s', '--seed', type=int, help='seed for random angles')
+    parser.add_argument('-t', '--tree', action='store_true', help='shrink and tint branches on @')
+    parser.add_argument('-o', '--output', help='render to .svg or .png without opening a window')
+    parser.add_argument('--size', default='1000x800', help='image size, WxH')
+    parser.add_argument('--budget', type=int, default=Plotter.budget >> 20, help='memory budget in MB')
+    parser.add_argument('--time-budget', type=float, default=Plotter.time_budget,
+                        help='time budget in seconds, estimated from the predicted number of segments')
+    parser.add_argument('--lod', type=float, metavar='PX',
+                        help='draw subtrees smaller than PX pixels as single strokes')
+    parser.add_argument('-j', '--jobs', type=int, nargs='?', const=0,
+                        help='build subtrees in JOBS processes, all cores if omitted')
+    parser.add_argument('--cache', nargs='?', const=Store.default(), metavar='DIR',
+                        help=f'keep expanded generations in an on-disk cache, in {Store.default()} if DIR is omitted')
+    parser.add_argument('--cache-size', type=int, default=Store.size >> 20,
+                        help='size of the on-disk cache in MB, least recently used entries go first')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf8') as f:
         lsystem = LSystem.parse(f.read())
-    Plotter(lsystem)
+    if args.seed is not None:
+        lsystem.seed = args.seed
+    store = None if args.cache is None else Store(args.cache, args.cache_size << 20)
+    if args.output is None:
+        Plotter(lsystem, args.angle, store)
+        return
+    width, height = map(int, args.size.split('x'))
+    budget, seconds = args.budget << 20, args.time_budget
+    fits = lsystem.affordable(args.n, budget, seconds)
+    within = f'{args.budget} MB and {seconds:g} s'
+    if args.lod is None and not fits:
+        parser.error(f'N={args.n} needs about {lsystem.cost(args.n) >> 20} MB and {lsystem.seconds(args.n):.0f} s, '
+                     f'N={lsystem.fitting(args.n, budget, seconds)} is the largest that fits in {within}')
+    try:
+        count, elapsed = export(lsystem, args.n, args.output, width, height, args.angle, args.tree,
+                                detail=args.lod, jobs=args.jobs, store=store,
+                                limit=None if fits else lsystem.limit(budget, seconds))
+    except OverBudget as e:
+        parser.error(f'{e}, more than fits in {within}; '
+                     f'N={lsystem.fitting(args.n, budget, seconds)} fits without level of detail')
+    print(f'{args.file}: N={args.n}, {count} segments in {elapsed:.3f} s '
+          f'({count / max(elapsed, 1e-9):.0f} segments/s) -> {args.output}')
 
 
 if __name__ == '__main__':
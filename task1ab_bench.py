@@ -0,0 +1,118 @@
+"""Headless benchmarks of L-system expansion and geometry.
+
+Runs the fractals of task1ab_test.py at growing N and writes the results
+to a JSON file; with --baseline the run fails if anything got slower.
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+from time import perf_counter
+from task1ab import LSystem, interpret
+
+FRACTALS = {
+    'koch_curve': ('F -60 F\nF -> F-F++F-F', False),
+    'koch_curve90': ('F 90 F\nF -> F+F-F-F+F', False),
+    'koch_snowflake': ('F 60 F++F++F\nF -> F-F++F-F', False),
+    'koch_island': ('F 90 F+F+F+F\nF -> F+F-F-FF+F+F-F', False),
+    'sierpinski_triangle': ('F G 120 F-G-G\nF -> F-G+F+G-F\nG -> GG', False),
+    'sierpinski_arrowhead': ('X Y F 60 YF\nX -> YF+XF+Y\nY -> XF-YF-X', False),
+    'dragon_curve': ('X Y F 90 X\nF -> F\nX -> X+YF+\nY -> -FX-Y', False),
+    'color_tree': ('F 0..45 X\nX -> F[@[-X]+X]', True),
+}
+
+
+def best(f, repeat: int) -> float:
+    """Shortest of repeat runs of f, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        f()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def measure(source: str, n: int, tree: bool, repeat: int = 3) -> dict:
+    """Expansion, geometry and streaming time and peak memory of generation n"""
+    lsystem = LSystem.parse(source)
+    lsystem.seed = 0
+    symbols, segments = lsystem.predict(n)
+
+    def expand():
+        lsystem.forget()
+        return lsystem.generate(n)
+
+    codes, _ = expand()
+    expand_s = best(expand, repeat)
+    geometry_s = best(lambda: interpret(lsystem, codes, 0, 1, tree), repeat)
+    # посимвольный обход, которым рисует Plotter.draw
+    stream_s = best(lambda: sum(1 for _ in lsystem.expand(n)), repeat)
+
+    tracemalloc.start()
+    interpret(lsystem, expand()[0], 0, 1, tree)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'n': n, 'symbols': symbols, 'segments': segments,
+            'expand_s': expand_s, 'geometry_s': geometry_s, 'stream_s': stream_s,
+            'peak_bytes': peak, 'segments_per_s': segments / max(expand_s + geometry_s, 1e-9)}
+
+
+def run(limit: int = 2**20, repeat: int = 3, fractals: dict = FRACTALS) -> dict[str, list[dict]]:
+    """Measure every fractal at N = 1, 2, ... while it has at most limit symbols"""
+    results = {}
+    for name, (source, tree) in fractals.items():
+        lsystem = LSystem.parse(source)
+        results[name] = []
+        n = 1
+        while lsystem.predict(n)[0] <= limit:
+            results[name].append(measure(source, n, tree, repeat))
+            n += 1
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 1.5, floor: float = 0.005) -> list[str]:
+    """Timings that grew more than tolerance times over the baseline.
+
+    Timings under floor seconds in both runs are noise and are skipped.
+    """
+    slower = []
+    for name, rows in results.items():
+        old = {row['n']: row for row in baseline.get(name, [])}
+        for row in rows:
+            if row['n'] not in old:
+                continue
+            for key in ('expand_s', 'geometry_s', 'stream_s'):
+                before, after = old[row['n']][key], row[key]
+                if after > floor and after > tolerance * before:
+                    slower.append(f'{name} N={row["n"]} {key}: {before:.4f} s -> {after:.4f} s')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='L-system benchmarks')
+    parser.add_argument('-o', '--output', default='task1ab_bench.json', help='where to write the results')
+    parser.add_argument('--limit', type=int, default=2**20, help='largest generation, in symbols')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one counts')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = run(args.limit, args.repeat)
+    for name, rows in results.items():
+        for row in rows:
+            print(f'{name:22} N={row["n"]:<3} {row["symbols"]:>9} symbols  expand {row["expand_s"]:.4f} s  '
+                  f'geometry {row["geometry_s"]:.4f} s  stream {row["stream_s"]:.4f} s  '
+                  f'{row["peak_bytes"] >> 10:>7} KB  {row["segments_per_s"]:.0f} segments/s')
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for line in slower:
+            print('slower:', line)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,22 @@
+import itertools
+import math
+import os
+import sys
+import tempfile
 import unittest
-from task1ab import LSystem, Plotter
+from functools import cache
+from types import SimpleNamespace
+import numpy as np
+from task1ab import (LSystem, OverBudget, Plotter, Renderer, Scheduler, Store, Worker, export, interpret, lod,
+                     parallel, rasterize)
+from task1ab_bench import FRACTALS, compare, run
+
+
+@cache
+def tree_source() -> str:
+    """The tree from task1a.txt, read once"""
+    with open('task1a.txt', encoding='utf8') as f:
+        return f.read()
 
 
 class TestTask1a(unittest.TestCase):
@@ -144,3 +161,572 @@ class TestTask1a(unittest.TestCase):
         self.assertEqual(lsystem.apply(), 'F[@[-X]+X]')
         if self.VISUAL:
             Plotter(lsystem, 90)
+
+
+class TestExpansion(unittest.TestCase):
+    def test_expand_matches_apply(self):
+        lsystem = LSystem.parse('''
+            X Y F 90 X
+            F -> F
+            X -> X+YF+
+            Y -> -FX-Y''')
+        for n in range(8):
+            self.assertEqual(''.join(lsystem.expand(n)), lsystem.apply(n))
+
+    def test_first_rule_wins(self):
+        lsystem = LSystem.parse('''
+            F 90 FG
+            F -> F+F
+            F -> G
+            G -> GG''')
+        self.assertEqual(lsystem.apply(2), 'F+F+F+FGGGG')
+
+    def test_generation_cache(self):
+        lsystem = LSystem.parse('''
+            F 90 F
+            F -> F+F-F''')
+        lsystem.cache_size = 1000
+        expected = [lsystem.axiom]
+        for _ in range(6):
+            expected.append(expected[-1].replace('F', 'F+F-F'))
+        self.assertEqual(lsystem.apply(6), expected[6])
+        self.assertEqual(lsystem.apply(5), expected[5])
+        self.assertNotIn(6, lsystem.generations)
+        cached = [s for i, s in lsystem.generations.items() if i]
+        self.assertLessEqual(sum(map(sys.getsizeof, cached)), 1000)
+
+
+def reference_segments(lsystem, state, ln=1.0, tree=False):
+    x = y = h = 0.0
+    stack, segs = [], []
+    for atom in state:
+        if atom in lsystem.atoms:
+            nx, ny = x + ln * math.cos(math.radians(h)), y + ln * math.sin(math.radians(h))
+            segs.append((x, y, nx, ny))
+            x, y = nx, ny
+        elif atom == '+':
+            h += lsystem.angle
+        elif atom == '-':
+            h -= lsystem.angle
+        elif atom == '[':
+            stack.append((x, y, h, ln))
+        elif atom == ']':
+            x, y, h, ln = stack.pop()
+        elif atom == '@' and tree:
+            ln *= 0.8
+    return segs
+
+
+class TestGrowth(unittest.TestCase):
+    def test_predict(self):
+        lsystem = LSystem.parse('''
+            F G 120 F-G-G
+            F -> F-G+F+G-F
+            G -> GG''')
+        for n in range(7):
+            state = lsystem.apply(n)
+            self.assertEqual(lsystem.predict(n), (len(state), state.count('F') + state.count('G')))
+            self.assertEqual(lsystem.counts(n)['-'], state.count('-'))
+
+    def test_huge_generation(self):
+        lsystem = LSystem.parse(tree_source())
+        self.assertEqual(lsystem.predict(60)[1], 2**60 - 1)
+        self.assertEqual(lsystem.fitting(60, lsystem.cost(12)), 12)
+
+    def test_time_budget(self):
+        lsystem = LSystem.parse(tree_source())
+        lsystem.segment_rate = 1000
+        self.assertAlmostEqual(lsystem.seconds(10), 1.023)
+        self.assertTrue(lsystem.affordable(10, 2**40))
+        self.assertFalse(lsystem.affordable(10, 2**40, 1))
+        self.assertEqual(lsystem.fitting(60, 2**40, 1), 9)
+        self.assertEqual(lsystem.limit(2**40, 1), 1000)
+
+
+class TestProgram(unittest.TestCase):
+    def test_context_free_matches_translate(self):
+        lsystem = LSystem.parse('''
+            F 22.5 X
+            F -> FF
+            X -> F-[[X]+X]+F[+FX]-X''')
+        codes, params = lsystem.program.axiom
+        for _ in range(4):
+            codes, params = lsystem.program.step(codes, params)
+        self.assertEqual(lsystem.program.decode(codes, None), lsystem.apply(4))
+
+    def test_context_sensitive(self):
+        lsystem = LSystem.parse('''
+            F 90 BAAA[A]A
+            B < A -> B''')
+        self.assertFalse(lsystem.simple)
+        self.assertEqual(lsystem.apply(1), 'BBAA[A]A')
+        self.assertEqual(lsystem.apply(3), 'BBBB[A]A')
+        self.assertEqual(lsystem.apply(4), 'BBBB[B]B')
+
+    def test_context_skips_branches(self):
+        lsystem = LSystem.parse('''
+            F 90 A+[B]C
+            A > C -> X
+            B < C -> Y
+            A < B -> Z''')
+        self.assertEqual(lsystem.apply(1), 'X+[Z]C')
+
+    def test_parametric(self):
+        lsystem = LSystem.parse('''
+            F 90 A(1)
+            A(x) : x < 4 -> F(x)[+A(x*2)]-A(x+1)''')
+        self.assertEqual(lsystem.apply(1), 'F(1)[+A(2)]-A(2)')
+        self.assertEqual(lsystem.apply(2), 'F(1)[+F(2)[+A(4)]-A(3)]-F(2)[+A(4)]-A(3)')
+        codes, params = lsystem.generate(2)
+        geometry = interpret(lsystem, codes, params=params)
+        np.testing.assert_allclose(geometry.segs[:, 2:], [[1, 0], [1, 2], [1, -2]], atol=1e-9)
+
+    def test_parametric_modules(self):
+        lsystem = LSystem(set('F'), 'F(1)', [('F(x)', 'F(x*2)+F(x)')], 60)
+        self.assertEqual(list(lsystem.expand(1)), ['F(2)', '+', 'F(1)'])
+        self.assertEqual(''.join(lsystem.expand(2)), lsystem.apply(2))
+        self.assertEqual(list(lsystem.modules(1)), [('F', 2.0), ('+', None), ('F', 1.0)])
+
+    def test_parametric_generations_are_cached(self):
+        lsystem = LSystem(set('F'), 'F(1)', [('F(x)', 'F(x*2)+F(x)')], 60)
+        codes, params = lsystem.generate(3)
+        self.assertEqual(sorted(lsystem.generations), [0, 1, 2, 3])
+        self.assertIs(lsystem.generate(3)[0], codes)
+        reported = []
+        lsystem.generate(5, reported.append)
+        self.assertEqual(reported, [0, 0.5])
+
+    def test_parametric_context(self):
+        lsystem = LSystem.parse('''
+            F 90 A(2)+C(3)
+            A(x) < C(y) -> D(x+y)''')
+        self.assertEqual(lsystem.apply(1), 'A(2)+D(5)')
+
+    def test_several_parameters(self):
+        lsystem = LSystem.parse('''
+            F 90 A(1,2)F(3)
+            A(x,y) : y < 8 -> A(x+y,y*2)F(max(x,y),1)
+            F(l,w) -> F(l*2,w)''')
+        self.assertEqual(lsystem.apply(1), 'A(3,4)F(2,1)F(6)')
+        self.assertEqual(lsystem.apply(2), 'A(7,8)F(4,1)F(4,1)F(12)')
+        self.assertEqual(lsystem.apply(3), 'A(7,8)F(8,1)F(8,1)F(24)')
+        codes, params = lsystem.generate(1)
+        self.assertEqual(params.shape, (3, 2))
+        geometry = interpret(lsystem, codes, params=params)
+        np.testing.assert_allclose(geometry.segs[:, 2], [2, 8], atol=1e-9)
+
+    def test_rejects_code(self):
+        with self.assertRaises(ValueError):
+            LSystem.parse('''
+                F 90 A(1)
+                A(x) : __import__('os') -> A(x)''')
+
+
+class TestGeometry(unittest.TestCase):
+    def check(self, source, n, tree=False):
+        lsystem = LSystem.parse(source)
+        state = lsystem.apply(n)
+        geometry = interpret(lsystem, state, tree=tree)
+        expected = reference_segments(lsystem, state, tree=tree)
+        self.assertEqual(len(geometry), len(expected))
+        np.testing.assert_allclose(geometry.segs, np.array(expected).reshape(-1, 4), atol=1e-9)
+
+    def test_koch_snowflake(self):
+        self.check('''
+            F 60 F++F++F
+            F -> F-F++F-F''', 3)
+
+    def test_pushdown_tree3(self):
+        self.check('''
+            F 22.5 X
+            F -> FF
+            X -> F-[[X]+X]+F[+FX]-X''', 4)
+
+    def test_mosaic(self):
+        self.check('''
+            F 60 X
+            F -> F
+            X -> [-F+F[Y]+F][+F-F[X]-F]
+            Y -> [-F+F[Y]+F][+F-F-F]''', 5)
+
+    def test_color_tree(self):
+        self.check('''
+            F 30 X
+            X -> F[@[-X]+X]''', 6, tree=True)
+
+    def test_unbalanced(self):
+        lsystem = LSystem.parse('''
+            F 90 F]F[
+            F -> F''')
+        with self.assertRaises(ValueError):
+            interpret(lsystem, lsystem.apply(1))
+
+
+class TestLevelOfDetail(unittest.TestCase):
+    def test_full_detail_matches_interpret(self):
+        lsystem = LSystem.parse('''
+            F 22.5 X
+            F -> FF
+            X -> F-[[X]+X]+F[+FX]-X''')
+        geometry = lod(lsystem, 4, 1e9)
+        np.testing.assert_allclose(geometry.segs, interpret(lsystem, lsystem.apply(4)).segs, atol=1e-6)
+
+    def test_bounded_by_resolution(self):
+        lsystem = LSystem.parse('''
+            F 60 F++F++F
+            F -> F-F++F-F''')
+        sizes = []
+        for n in (6, 8, 12, 20):
+            scale = 400 / lsystem.radius(n)
+            geometry = lod(lsystem, n, scale)
+            sizes.append(len(geometry))
+            x0, y0, x1, y1 = geometry.bbox
+            self.assertLessEqual(max(x1 - x0, y1 - y0) * scale, 800)
+        self.assertEqual(len(set(sizes)), 1)
+        self.assertLess(sizes[0], lsystem.predict(6)[1])
+
+    def test_random_angles_match_interpret(self):
+        lsystem = LSystem.parse(tree_source())
+        geometry = lod(lsystem, 9, 100, 0, tree=True, seed=5)
+        np.testing.assert_allclose(geometry.segs, interpret(lsystem, lsystem.apply(9), tree=True, seed=5).segs,
+                                   atol=1e-9)
+
+    def test_collapsed_subtree_skips_its_angles(self):
+        lsystem = LSystem.parse('''
+            F 10..20 X+F
+            X -> F+F-F+F''')
+        geometry = lod(lsystem, 1, 1e-3, seed=5)
+        self.assertEqual(len(geometry), 2)
+        x0, y0, x1, y1 = geometry.segs[-1]
+        turn = np.random.default_rng(5).uniform(10, 20, 4)[3]
+        self.assertAlmostEqual(math.degrees(math.atan2(y1 - y0, x1 - x0)), lsystem.chords(1)[1]['X'][2] + turn)
+
+    def test_limit(self):
+        lsystem = LSystem.parse(tree_source())
+        # бинарное дерево не схлопывается: отрезков столько же, сколько без детализации
+        reported = []
+        geometry = lod(lsystem, 14, 400 / lsystem.radius(14, True), tree=True, progress=reported.append)
+        self.assertEqual(len(geometry), lsystem.predict(14)[1])
+        self.assertEqual(len(reported), len(geometry) // 4096)
+        self.assertEqual(reported, sorted(reported))
+        self.assertTrue(0 < reported[-1] < 1)
+        with self.assertRaises(OverBudget):
+            lod(lsystem, 30, 400 / lsystem.radius(30, True), tree=True, limit=10000)
+
+
+class TestParallel(unittest.TestCase):
+    def test_matches_interpret(self):
+        lsystem = LSystem.parse('''
+            F 25 X
+            X -> F[@[-X]+X]''')
+        expected = interpret(lsystem, lsystem.apply(7), 90, 1, True)
+        geometry = parallel(lsystem, 7, 90, True, jobs=2)
+        np.testing.assert_allclose(geometry.segs, expected.segs, atol=1e-9)
+        np.testing.assert_array_equal(geometry.colors, expected.colors)
+
+    def test_random_angles_are_reproducible(self):
+        lsystem = LSystem.parse(tree_source())
+        a = parallel(lsystem, 7, tree=True, seed=1, jobs=2)
+        b = parallel(lsystem, 7, tree=True, seed=1, jobs=2)
+        self.assertEqual(len(a), 2**7 - 1)
+        np.testing.assert_array_equal(a.segs, b.segs)
+
+
+class FakeCanvas:
+    def __init__(self):
+        self.lines = []
+
+    def create_line(self, coords, **kwargs):
+        self.lines.append((coords, kwargs))
+
+    def delete(self, tag):
+        self.lines = []
+
+
+class TestRandomAngles(unittest.TestCase):
+    def test_seed_is_reproducible(self):
+        source = tree_source()
+        a = LSystem.parse(source)
+        b = LSystem.parse(source)
+        b.seed = a.seed
+        state = a.apply(7)
+        np.testing.assert_array_equal(interpret(a, state).segs, interpret(b, state).segs)
+        self.assertFalse(np.array_equal(interpret(a, state).segs, interpret(a, state, seed=a.seed + 1).segs))
+
+    def test_stream_matches_bulk(self):
+        lsystem = LSystem.parse(tree_source())
+        state = lsystem.apply(12)
+        turns = lsystem.turns(np.array([ord(c) for c in state]))
+        turns = turns[turns != 0]
+        angles = lsystem.angles()
+        streamed = [next(angles) for _ in range(len(turns))]
+        np.testing.assert_array_equal(np.abs(turns), streamed)
+        self.assertTrue(((turns >= 0) & (turns <= 45) | (turns <= 0) & (turns >= -45)).all())
+
+    def test_skip(self):
+        lsystem = LSystem.parse(tree_source())
+        expected = list(itertools.islice(lsystem.angles(), 10000))
+        angles = lsystem.angles()
+        streamed = [next(angles)]
+        angles.skip(4)
+        streamed.append(next(angles))
+        angles.skip(5000)
+        streamed.append(next(angles))
+        self.assertEqual(streamed, [expected[0], expected[5], expected[5006]])
+
+
+class TestPalette(unittest.TestCase):
+    def test_matches_repeated_tint(self):
+        plotter = SimpleNamespace(pensz=4, col=(139, 69, 19), ln=10)
+        widths, colors, lengths = Plotter.palette(plotter, 40)
+        # состояние пера, которое col_draw раньше пересчитывал на каждой @
+        pw, col, ln = plotter.pensz, plotter.col, plotter.ln
+        for d in range(40):
+            self.assertAlmostEqual(widths[d], pw)
+            self.assertEqual(colors[d], '#%02x%02x%02x' % col)
+            self.assertAlmostEqual(lengths[d], ln)
+            pw *= 0.8
+            ln *= 0.8
+            col = tuple(int(c + (255 - c) * 0.1) for c in col)
+
+
+class TestRenderer(unittest.TestCase):
+    def test_polylines(self):
+        lsystem = LSystem.parse('''
+            F 90 X
+            X -> F[+X][-X]''')
+        geometry = interpret(lsystem, lsystem.apply(3))
+        canvas = FakeCanvas()
+        renderer = Renderer(canvas)
+        renderer.draw(geometry, 10, 5, 0)
+        # одна полилиния на каждую непрерывную ветку
+        self.assertEqual(len(canvas.lines), 4)
+        self.assertEqual(sum(len(c) // 2 - 1 for c, _ in canvas.lines), len(geometry))
+        self.assertEqual(canvas.lines[0][0][:4], [5.0, -0.0, 15.0, -0.0])
+
+    def test_long_run_is_split(self):
+        lsystem = LSystem.parse('''
+            F 90 F
+            F -> F+F-F-F+F''')
+        geometry = interpret(lsystem, lsystem.apply(3))
+        canvas = FakeCanvas()
+        renderer = Renderer(canvas)
+        renderer.span = 40
+        steps = list(renderer.steps(geometry))
+        self.assertEqual(len(Renderer.runs(geometry)), 1)
+        self.assertEqual([len(c) // 2 - 1 for c, _ in canvas.lines], [40, 40, 40, 5])
+        self.assertEqual(len(steps), 3)
+        self.assertEqual(canvas.lines[1][0][:2], canvas.lines[0][0][-2:])
+
+    def test_fit(self):
+        lsystem = LSystem.parse('''
+            F 90 F+F+F
+            F -> F''')
+        geometry = interpret(lsystem, lsystem.apply(1))
+        np.testing.assert_allclose(geometry.bbox, (0, 0, 1, 1), atol=1e-9)
+        np.testing.assert_allclose(geometry.fit(120, 220, 10), (100, -50, -50))
+
+    def test_rasterize(self):
+        lsystem = LSystem.parse('''
+            F 90 F
+            F -> FF''')
+        geometry = interpret(lsystem, lsystem.apply(2))
+        img = rasterize(geometry, 20, 10, 2)
+        self.assertEqual(img.shape, (10, 20, 3))
+        row = img[5, :, 0]
+        self.assertTrue((row[10:19] == 0).all())
+        self.assertTrue((row[:9] == 255).all())
+
+    def test_rasterize_clips_to_the_image(self):
+        lsystem = LSystem.parse('''
+            F 90 F
+            F -> FF''')
+        geometry = interpret(lsystem, lsystem.apply(2))
+        # при таком увеличении отрезки длиннее миллиарда пикселей
+        img = rasterize(geometry, 20, 10, 1e9)
+        row = img[5, :, 0]
+        self.assertTrue((row[10:] == 0).all())
+        self.assertTrue((row[:9] == 255).all())
+        img = rasterize(geometry, 20, 10, 1e9, y=1e6)
+        self.assertTrue((img == 255).all())
+
+
+class FakeWidget:
+    def __init__(self):
+        self.calls = {}
+        self.ids = 0
+
+    def after(self, delay, func, *args):
+        self.ids += 1
+        self.calls[self.ids] = (func, args)
+        return self.ids
+
+    def after_cancel(self, i):
+        del self.calls[i]
+
+    def run(self):
+        while self.calls:
+            func, args = self.calls.pop(min(self.calls))
+            func(*args)
+
+
+class TestScheduler(unittest.TestCase):
+    def test_latest_request_wins(self):
+        widget = FakeWidget()
+        scheduler = Scheduler(widget)
+        done = []
+
+        def job(i):
+            for _ in range(3):
+                yield
+            done.append(i)
+
+        for i in range(5):
+            scheduler.request(lambda i=i: job(i))
+        widget.run()
+        self.assertEqual(done, [4])
+
+    def test_cancel_running_job(self):
+        widget = FakeWidget()
+        scheduler = Scheduler(widget)
+        scheduler.budget = 0
+        steps = []
+
+        def job():
+            while True:
+                steps.append(1)
+                yield
+
+        scheduler.request(job)
+        func, args = widget.calls.pop(min(widget.calls))
+        func(*args)
+        self.assertEqual(len(steps), 1)
+        scheduler.cancel()
+        self.assertEqual(widget.calls, {})
+        self.assertIsNone(scheduler.job)
+
+
+class TestWorker(unittest.TestCase):
+    def test_progress(self):
+        lsystem = LSystem.parse(tree_source())
+        reported = []
+        worker = Worker(lambda report: lsystem.apply(4, lambda f: (reported.append(f), report(f))))
+        worker.start()
+        worker.join()
+        self.assertEqual(worker.result, lsystem.apply(4))
+        self.assertEqual(reported, [0, 0.25, 0.5, 0.75])
+
+    def test_cancel(self):
+        lsystem = LSystem.parse(tree_source())
+        worker = Worker(lambda report: lsystem.apply(10, report))
+        worker.cancel()
+        worker.start()
+        worker.join()
+        self.assertIsNone(worker.result)
+        self.assertIsNone(worker.error)
+        self.assertEqual(list(lsystem.generations), [0])
+
+    def test_cancel_while_interpreting(self):
+        lsystem = LSystem.parse(tree_source())
+        reported = []
+
+        def report(f):
+            reported.append(f)
+            if f > 0.8:
+                worker.cancel()
+            worker.report(f)
+
+        with tempfile.TemporaryDirectory() as d:
+            worker = Worker(lambda _: Store(d).geometry(lsystem, 8, progress=report))
+            worker.start()
+            worker.join()
+            self.assertIsNone(worker.result)
+            self.assertIsNone(worker.error)
+            self.assertEqual(reported[-1], 0.8 + 0.2 * 0.2)
+            # поколение сохранено, геометрия — нет
+            names = [name for _, _, files in os.walk(d) for name in files]
+            self.assertEqual(names, ['codes.npy'])
+
+
+class TestExport(unittest.TestCase):
+    def test_png_and_svg(self):
+        lsystem = LSystem.parse(tree_source())
+        with tempfile.TemporaryDirectory() as d:
+            png = os.path.join(d, 'tree.png')
+            count, _ = export(lsystem, 6, png, 64, 48, 90, True)
+            self.assertEqual(count, 63)
+            with open(png, 'rb') as f:
+                head = f.read(24)
+            self.assertEqual(head[:8], b'\x89PNG\r\n\x1a\n')
+            self.assertEqual(head[16:24], bytes([0, 0, 0, 64, 0, 0, 0, 48]))
+            svg = os.path.join(d, 'tree.svg')
+            export(lsystem, 6, svg, 64, 48, 90, True)
+            with open(svg, encoding='utf8') as f:
+                self.assertEqual(f.read().count('<polyline'), 63)
+            count, _ = export(lsystem, 40, png, 64, 48, 90, True, detail=1)
+            self.assertLess(count, 2**12)
+
+
+class TestStore(unittest.TestCase):
+    def test_geometry_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as d:
+            source = tree_source()
+            lsystem = LSystem.parse(source)
+            first = Store(d).geometry(lsystem, 8, 90, True, seed=3)
+            again = Store(d).geometry(LSystem.parse(source), 8, 90, True, seed=3)
+            self.assertIsInstance(again.segs, np.memmap)
+            np.testing.assert_array_equal(again.segs, first.segs)
+            np.testing.assert_array_equal(again.colors, first.colors)
+            other = Store(d).geometry(lsystem, 8, 90, True, seed=4)
+            self.assertFalse(np.array_equal(other.segs, first.segs))
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as d:
+            store = Store(d, 2500)
+            a, b, c = (('a',), ('b',), ('c',))
+            for i, key in enumerate((a, b)):
+                store.save(key, codes=np.zeros(100))
+                os.utime(os.path.dirname(store.path(key, '')), (i, i))
+            self.assertIsNotNone(store.load(a, 'codes'))
+            store.save(c, codes=np.zeros(100))
+            self.assertIsNotNone(store.load(a, 'codes'))
+            self.assertIsNone(store.load(b, 'codes'))
+            self.assertIsNotNone(store.load(c, 'codes'))
+
+    def test_scans_only_over_budget(self):
+        with tempfile.TemporaryDirectory() as d:
+            store = Store(d, 2500)
+            scans = []
+            entries = store.entries
+            store.entries = lambda: scans.append(1) or entries()
+            store.save(('a',), codes=np.zeros(100))
+            store.save(('a',), codes=np.zeros(100))
+            store.save(('b',), codes=np.zeros(100))
+            self.assertEqual((len(scans), store.total), (1, 2 * 928))
+            store.save(('c',), codes=np.zeros(100))
+            self.assertEqual((len(scans), store.total), (2, 2 * 928))
+
+    def test_parametric(self):
+        with tempfile.TemporaryDirectory() as d:
+            lsystem = LSystem.parse('''
+                F 90 F(1)
+                F(x) -> F(x*2)+F(x)''')
+            codes, params = Store(d).generate(lsystem, 3)
+            cached = Store(d).generate(lsystem, 3)
+            np.testing.assert_array_equal(cached[0], codes)
+            np.testing.assert_array_equal(cached[1], params)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        results = run(limit=200, repeat=1)
+        self.assertEqual(set(results), set(FRACTALS))
+        rows = results['koch_snowflake']
+        self.assertEqual([row['n'] for row in rows], [1, 2])
+        self.assertEqual(rows[1]['segments'], 48)
+        self.assertGreater(rows[1]['peak_bytes'], 0)
+
+    def test_compare(self):
+        old = {'tree': [{'n': 8, 'expand_s': 0.1, 'geometry_s': 0.1, 'stream_s': 0.001}]}
+        new = {'tree': [{'n': 8, 'expand_s': 0.3, 'geometry_s': 0.1, 'stream_s': 0.004}]}
+        self.assertEqual(compare(new, old), ['tree N=8 expand_s: 0.1000 s -> 0.3000 s'])
@@ -1,8 +1,15 @@
-from queue import Queue
 import tkinter as tk
+from tkinter import filedialog
+import argparse
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from random import randint
+from itertools import repeat
+from random import getrandbits
 import numpy as np
+from pngfile import SIGNATURE, png_chunk
 
 # import pyjion
 # pyjion.enable()
@@ -13,81 +20,394 @@ class Point:
     x: int
     y: int
 
-    def draw(self, canvas: tk.Canvas, color: str = "black", radius: int = 5):
-        canvas.create_oval(self.x - radius, self.y - radius, self.x + radius,
-                           self.y + radius, fill=color, outline=color)
-
-    def __eq__(self, __o: object) -> bool:
-        if isinstance(__o, Point):
-            return self.x == __o.x and self.y == __o.y
-        return False
-
     def __iter__(self):
         yield self.x
         yield self.y
 
-    def in_rect(self, p1: 'Point', p2: 'Point') -> bool:
-        maxx = max(p1.x, p2.x)
-        minx = min(p1.x, p2.x)
-        maxy = max(p1.y, p2.y)
-        miny = min(p1.y, p2.y)
-        return minx <= self.x <= maxx and miny <= self.y <= maxy
 
-    def transform(self, transform: np.ndarray):
-        p = np.array([self.x, self.y, 1])
-        p = np.matmul(transform, p)
-        self.x = int(p[0])
-        self.y = int(p[1])
+@dataclass
+class Line:
+    p1: Point
+    p2: Point
+
+
+def split(heights: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Split every segment in two at its midpoint shifted by the offset"""
+    out = np.empty(2 * len(heights) - 1)
+    out[::2] = heights
+    out[1::2] = (heights[:-1] + heights[1:]) / 2 + offsets
+    return out
 
-    def highlight(self, canvas: tk.Canvas, timeout: int = 200, r: int = 5):
-        highlight = canvas.create_oval(self.x - r, self.y - r, self.x + r,
-                                       self.y + r, fill="red", outline="red")
-        canvas.after(timeout, canvas.delete, highlight)
 
-    @property
-    def center(self) -> 'Point':
-        return Point(self.x, self.y)
+def refine(heights: np.ndarray, noise: float, tear: int, rng: np.random.Generator) -> np.ndarray:
+    """One level of midpoint displacement: every segment is split in two at a shifted midpoint"""
+    return split(heights, noise * rng.integers(-tear, tear, len(heights) - 1, endpoint=True))
 
 
 @dataclass
-class Line:
-    p1: Point
-    p2: Point
+class Midpoint:
+    """Midpoint displacement whose offsets shrink by 2^-hurst every level"""
+    tear: float = 25
+    hurst: float = 0.5
+
+    def profile(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """2^n + 1 heights of a profile with ends at 0"""
+        heights = np.zeros(2)
+        for k in range(n):
+            heights = split(heights, rng.uniform(-1, 1, len(heights) - 1) * self.tear * 2 ** (-self.hurst * k))
+        return heights
+
+
+@dataclass
+class ValueNoise:
+    """Fractal sum of value noise: octave k puts random values on 2^k cells and
+    blends them smoothly, with its amplitude scaled by 2^-hurst*k.
+
+    Level n sums n octaves, so a deeper profile refines a shallower one.
+    """
+    tear: float = 25
+    hurst: float = 0.5
+
+    def profile(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        heights = np.zeros(2 ** n + 1)
+        for k in range(n):
+            cells = 2 ** k
+            # во всех клетках октавы точки лежат на одних и тех же долях клетки
+            t = np.linspace(0, 1, 2 ** (n - k) + 1)
+            block = self.octave(t, cells, rng) * self.tear * 2 ** (-self.hurst * k)
+            heights[:-1] += block[:, :-1].ravel()
+            heights[-1] += block[-1, -1]
+        return heights
+
+    def octave(self, t: np.ndarray, cells: int, rng: np.random.Generator) -> np.ndarray:
+        """Noise within ±1 at fractions t of each of the cells, one row per cell"""
+        values = rng.uniform(-1, 1, cells + 1)
+        t = t * t * (3 - 2 * t)
+        return values[:-1, None] + np.diff(values)[:, None] * t
+
+
+class Perlin(ValueNoise):
+    """Fractal sum of Perlin gradient noise, otherwise like ValueNoise"""
+
+    def octave(self, t: np.ndarray, cells: int, rng: np.random.Generator) -> np.ndarray:
+        grads = rng.uniform(-1, 1, cells + 1)
+        a = grads[:-1, None] * t
+        b = grads[1:, None] * (t - 1)
+        fade = t ** 3 * (t * (t * 6 - 15) + 10)
+        return 2 * (a + (b - a) * fade)
+
+
+@dataclass
+class Spectral:
+    """Spectral synthesis: harmonic f gets amplitude f^-(hurst + 1/2) and a random
+    phase, and the profile is their sum from one inverse FFT.
+
+    The profile is periodic, so its ends meet.
+    """
+    tear: float = 25
+    hurst: float = 0.5
+
+    def profile(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        size = 2 ** n
+        if size < 2:
+            return np.zeros(2)
+        f = np.arange(1, size // 2 + 1)
+        spectrum = np.zeros(size // 2 + 1, dtype=complex)
+        spectrum[1:] = f ** -(self.hurst + 0.5) * rng.normal(size=len(f)) * np.exp(2j * np.pi * rng.random(len(f)))
+        # irfft делит на size; первая гармоника получает амплитуду порядка tear
+        heights = np.fft.irfft(spectrum * self.tear * size / 2, size)
+        return np.append(heights, heights[0])
+
+
+ENGINES = {'midpoint': Midpoint, 'value': ValueNoise, 'perlin': Perlin, 'spectral': Spectral}
+
+
+def diamond_square(heights: np.ndarray, amp: float, rng: np.random.Generator) -> np.ndarray:
+    """One level of diamond-square: an (m + 1)² grid becomes (2m + 1)²"""
+    m = len(heights) - 1
+    out = np.empty((2 * m + 1, 2 * m + 1), dtype=np.float32)
+    out[::2, ::2] = heights
+
+    def offsets(shape: tuple) -> np.ndarray:
+        return (rng.random(shape, dtype=np.float32) * 2 - 1) * amp
+
+    # diamond: центр клетки — среднее её углов
+    centers = (heights[:-1, :-1] + heights[:-1, 1:] + heights[1:, :-1] + heights[1:, 1:]) / 4 + offsets((m, m))
+    out[1::2, 1::2] = centers
+    # square: середина ребра — среднее двух углов и центров по обе стороны, на краю их три
+    rows = heights[:, :-1] + heights[:, 1:]
+    rows[1:] += centers
+    rows[:-1] += centers
+    count = np.full((m + 1, 1), 4, dtype=np.float32)
+    count[[0, -1]] = 3
+    out[::2, 1::2] = rows / count + offsets((m + 1, m))
+    cols = heights[:-1, :] + heights[1:, :]
+    cols[:, 1:] += centers
+    cols[:, :-1] += centers
+    out[1::2, ::2] = cols / count.T + offsets((m, m + 1))
+    return out
+
+
+def shade(heights: np.ndarray, width: int, height: int) -> np.ndarray:
+    """RGB image of a heightmap coloured by height and lit from the north-west.
+
+    Big maps are subsampled and small ones repeated to fit in width x height.
+    """
+    step = max(1, -(-len(heights) // min(width, height)))
+    h = heights[::step, ::step].astype(float)
+    lo, hi = h.min(), h.max()
+    t = (h - lo) / max(hi - lo, 1e-9)
+    gy, gx = np.gradient(t * len(t) / 4)
+    light = np.clip((-gx - gy + 1) / np.sqrt(3 * (gx ** 2 + gy ** 2 + 1)), 0, 1)
+    stops = [0, 0.45, 0.75, 1]
+    ramp = [(60, 110, 60), (140, 125, 80), (120, 110, 100), (250, 250, 250)]
+    rgb = np.stack([np.interp(t, stops, channel) for channel in zip(*ramp)], axis=-1)
+    img = (rgb * (0.35 + 0.65 * light[..., None])).astype(np.uint8)
+    zoom = max(1, min(width, height) // len(img))
+    return img.repeat(zoom, axis=0).repeat(zoom, axis=1)
+
+
+def outline(xs: np.ndarray, heights: np.ndarray, columns: int) -> np.ndarray:
+    """Flat x, y coordinates of a polyline decimated to about columns pixels.
+
+    Longer polylines keep the ends and the lowest and the highest point of
+    every column in the order they come, so peaks survive and the output
+    stays bounded.
+    """
+    n = len(heights)
+    if n > 2 * columns:
+        size = -(-n // columns)
+        pad = -n % size
+        h = np.pad(heights, (0, pad), mode='edge').reshape(-1, size)
+        x = np.pad(xs, (0, pad), mode='edge').reshape(-1, size)
+        lo = h.argmin(axis=1)
+        hi = h.argmax(axis=1)
+        first = np.minimum(lo, hi)
+        second = np.maximum(lo, hi)
+        rows = np.arange(len(h))
+        xs = np.column_stack((x[rows, first], x[rows, second])).ravel()
+        heights = np.column_stack((h[rows, first], h[rows, second])).ravel()
+        # концы ломаной сохраняем как есть
+        xs = np.concatenate(([x[0, 0]], xs, [x[-1, -1]]))
+        heights = np.concatenate(([h[0, 0]], heights, [h[-1, -1]]))
+    return np.column_stack((xs, heights)).ravel()
+
+
+def frames(levels: list[np.ndarray], x0: float, x1: float, columns: int) -> np.ndarray:
+    """Outlines of successive levels padded to one length and stacked, one row per level.
+
+    Padding repeats the last point, so every frame sends as many
+    coordinates to the canvas.
+    """
+    outlines = [outline(np.linspace(x0, x1, len(h)), h, columns) for h in levels]
+    size = max(map(len, outlines))
+    stack = np.empty((len(outlines), size), dtype=np.float32)
+    for row, coords in zip(stack, outlines):
+        row[:len(coords)] = coords
+        row[len(coords):] = np.tile(coords[-2:], (size - len(coords)) // 2)
+    return stack
+
+
+class Mountain:
+    """Midpoint displacement that keeps every level it has generated.
+
+    Level k draws its offsets from its own stream seeded with (seed, k), so
+    raising n only computes the new levels, lowering it returns a stored
+    one, and the same seed gives the same terrain for any noise and tear.
+    """
+    seed: int  # зерно всей истории
+    levels: list[np.ndarray]  # высоты после 0, 1, 2... уровней
+
+    def __init__(self, start: np.ndarray, noise: float, tear: int, seed: int | None = None):
+        self.noise = noise
+        self.tear = tear
+        self.seed = getrandbits(32) if seed is None else seed
+        self.levels = [np.asarray(start, dtype=float)]
+
+    def level(self, n: int) -> np.ndarray:
+        """Heights after n levels, computing the missing ones"""
+        while len(self.levels) <= n:
+            rng = np.random.default_rng((self.seed, len(self.levels)))
+            self.levels.append(self.refine(self.levels[-1], len(self.levels), rng))
+        return self.levels[n]
+
+    def refine(self, heights: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        """Level k from level k - 1"""
+        return refine(heights, self.noise, self.tear, rng)
 
-    def draw(self, canvas: tk.Canvas, color: str = "black"):
-        canvas.create_line(self.p1.x, self.p1.y, self.p2.x, self.p2.y, fill=color)
 
-    def in_rect(self, p1: Point, p2: Point) -> bool:
-        """Проверка, что линия пересекает прямоугольник"""
-        return all((self.p1.in_rect(p1, p2), self.p2.in_rect(p1, p2)))
+class Heightmap(Mountain):
+    """Diamond-square heightmap with the same seeded history as Mountain.
 
-    def transform(self, transform: np.ndarray):
-        self.p1.transform(transform)
-        self.p2.transform(transform)
+    Tear is the amplitude of the first level and every next one is scaled
+    by Noise / 2: Noise = 1 halves it as in the classic algorithm, Noise = 2
+    keeps it constant.
+    """
 
-    def highlight(self, canvas: tk.Canvas, timeout: int = 200):
-        highlight = canvas.create_line(self.p1.x, self.p1.y, self.p2.x, self.p2.y, fill="red")
-        canvas.after(timeout, canvas.delete, highlight)
+    def refine(self, heights: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        return diamond_square(heights, self.tear * (self.noise / 2) ** (k - 1), rng)
 
-    @property
-    def center(self) -> Point:
-        return Point((self.p1.x + self.p2.x) // 2, (self.p1.y + self.p2.y) // 2)
 
-    def get_x(self, y: int) -> int:
-        """Получить x для точки с заданным y"""
-        if self.p1.x == self.p2.x:
-            return self.p1.x
-        return int((y - self.p1.y) * (self.p2.x - self.p1.x) / (self.p2.y - self.p1.y) + self.p1.x)
+def zigzag(*ints: int) -> tuple[int, ...]:
+    """Map integers of any sign to distinct non-negative ones, for seeding"""
+    return tuple(2 * i if i >= 0 else -2 * i - 1 for i in ints)
 
-    def copy(self):
-        return Line(Point(self.p1.x, self.p1.y), Point(self.p2.x, self.p2.y))
+
+class Tiles:
+    """Endless terrain generated a tile at a time from a world seed.
+
+    Tile (i, j) spans corners (i, j) to (i + 1, j + 1). Every corner and edge
+    is derived from the seed and its own coordinates only, so neighbours
+    agree on them, and tiles can be made lazily, in any order and in
+    separate processes. Corners are within ±tear and level k adds offsets
+    within ±tear * (noise / 2)^(k - 1), the same schedule as Heightmap.
+    """
+    CORNER, ROW, COLUMN, INSIDE = range(4)
+
+    def __init__(self, levels: int, noise: float, tear: float, seed: int | None = None):
+        self.levels = levels
+        self.noise = noise
+        self.tear = tear
+        self.seed = getrandbits(32) if seed is None else seed
+
+    def rng(self, kind: int, *ints: int) -> np.random.Generator:
+        return np.random.default_rng((self.seed, kind, *zigzag(*ints)))
+
+    def amp(self, k: int) -> float:
+        """Amplitude of level k, the same as in Heightmap.refine"""
+        return self.tear * (self.noise / 2) ** (k - 1)
+
+    def corner(self, i: int, j: int) -> float:
+        return self.rng(self.CORNER, i, j).uniform(-self.tear, self.tear)
+
+    def edge(self, i: int, j: int, kind: int) -> list[np.ndarray]:
+        """Levels of the edge from corner (i, j) along a row or a column"""
+        di, dj = (0, 1) if kind == self.ROW else (1, 0)
+        heights = np.array([self.corner(i, j), self.corner(i + di, j + dj)])
+        levels = [heights]
+        for k in range(1, self.levels + 1):
+            offsets = self.rng(kind, i, j, k).uniform(-1, 1, len(heights) - 1) * self.amp(k)
+            heights = split(heights, offsets)
+            levels.append(heights)
+        return levels
+
+    def profile(self, j: int) -> np.ndarray:
+        """Tile j of an endless midpoint displacement profile: the row edge of corner (0, j)"""
+        return self.edge(0, j, self.ROW)[-1]
+
+    def tile(self, i: int, j: int) -> np.ndarray:
+        """(2^levels + 1)² heights of tile (i, j), borders included"""
+        top, bottom = self.edge(i, j, self.ROW), self.edge(i + 1, j, self.ROW)
+        left, right = self.edge(i, j, self.COLUMN), self.edge(i, j + 1, self.COLUMN)
+        heights = np.array([[top[0][0], top[0][1]], [bottom[0][0], bottom[0][1]]], dtype=np.float32)
+        for k in range(1, self.levels + 1):
+            heights = diamond_square(heights, self.amp(k), self.rng(self.INSIDE, i, j, k))
+            # края берём общие с соседями, внутренность подстраивается под них на следующих уровнях
+            heights[0], heights[-1] = top[k], bottom[k]
+            heights[:, 0], heights[:, -1] = left[k], right[k]
+        return heights
+
+    def region(self, i: int, j: int, rows: int, cols: int, jobs: int | None = None,
+               out: np.ndarray | None = None) -> np.ndarray:
+        """Tiles (i, j) to (i + rows - 1, j + cols - 1) stitched into one map, built in a process pool.
+
+        Tiles are made one row of tiles at a time and written into out, which
+        may be a memory map, so only that row is held in memory.
+        """
+        size = 2 ** self.levels
+        if out is None:
+            out = np.empty((rows * size + 1, cols * size + 1), dtype=np.float32)
+        with ProcessPoolExecutor(jobs) as pool:
+            for r in range(rows):
+                band = pool.map(self.tile, repeat(i + r, cols), range(j, j + cols))
+                for c, tile in enumerate(band):
+                    out[r * size:(r + 1) * size + 1, c * size:(c + 1) * size + 1] = tile
+        return out
+
+
+def open_output(path: str, shape: tuple) -> np.ndarray:
+    """Writable float32 memory map: an .npy file or raw data for any other name"""
+    if path.lower().endswith('.npy'):
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+    return np.memmap(path, dtype=np.float32, mode='w+', shape=shape)
+
+
+def write_png16(path: str, heights: np.ndarray, band: int = 256):
+    """Save heights as a 16-bit greyscale PNG, stretched to the full range.
+
+    The map is read and compressed band rows at a time, so it can be a
+    memory map bigger than RAM.
+    """
+    heights = np.atleast_2d(heights)
+    h, w = heights.shape
+    bands = range(0, h, band)
+    lo = min(float(heights[r:r + band].min()) for r in bands)
+    hi = max(float(heights[r:r + band].max()) for r in bands)
+    scale = 65535 / max(hi - lo, 1e-9)
+    with open(path, 'wb') as f:
+        f.write(SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 16, 0, 0, 0, 0)))
+        z = zlib.compressobj(6)
+        for r in bands:
+            rows = ((heights[r:r + band] - lo) * scale + 0.5).astype('>u2')
+            raw = np.zeros((len(rows), 2 * w + 1), dtype=np.uint8)  # нулевой байт фильтра в начале строки
+            raw[:, 1:] = rows.view(np.uint8).reshape(len(rows), -1)
+            data = z.compress(raw.tobytes())
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+        f.write(png_chunk(b'IDAT', z.flush()))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def save(path: str, heights: np.ndarray) -> tuple[int, ...]:
+    """Write a profile or a heightmap to .npy, raw float32 or 16-bit .png"""
+    if path.lower().endswith('.png'):
+        write_png16(path, heights)
+    else:
+        out = open_output(path, heights.shape)
+        out[:] = heights
+        out.flush()
+    return heights.shape
+
+
+def export(tiles: Tiles, path: str, i: int = 0, j: int = 0, rows: int = 1, cols: int = 1,
+           profile: bool = False, jobs: int | None = None) -> tuple[int, ...]:
+    """Stream a block of tiles, or of profile tiles, to .npy, raw float32 or 16-bit .png.
+
+    The terrain goes straight into a memory-mapped file; a PNG is encoded
+    from a temporary one. Returns the shape of the terrain.
+    """
+    size = 2 ** tiles.levels
+    shape = (cols * size + 1,) if profile else (rows * size + 1, cols * size + 1)
+    png = path.lower().endswith('.png')
+    target = path + '.f32' if png else path
+    out = open_output(target, shape)
+    try:
+        if profile:
+            for c in range(cols):
+                out[c * size:(c + 1) * size + 1] = tiles.profile(j + c)
+        else:
+            tiles.region(i, j, rows, cols, jobs, out)
+        out.flush()
+        if png:
+            write_png16(path, out)
+    finally:
+        if png:
+            # временная карта может быть больше памяти, не оставляем её и при ошибке
+            del out
+            os.remove(target)
+    return shape
 
 
 class App(tk.Tk):
     W: int = 1000
     H: int = 600
     R: int = 5
-    lines: list[Line]
+    heights: np.ndarray  # высоты ломаной в равноотстоящих по x точках или карта высот
+    mountain: Mountain
+    heightmap: Heightmap
+    map_levels: int = 12  # карта не больше 4097²
+    fps: int = 4  # уровней в секунду при проигрывании
     start: Line
     n: int = 0
     noise: float = 1
@@ -99,80 +419,190 @@ class App(tk.Tk):
         self.geometry(f"{self.W}x{self.H}")
         self.resizable(0, 0)
         self.start = Line(Point(50, self.H / 2), Point(self.W - 50, self.H / 2))
+        self.mountain = history('profile', self.noise, self.tear)
+        self.heightmap = history('heightmap', self.noise, self.tear, self.mountain.seed)
         self.create_widgets()
-        self.start.draw(self.canvas)
         self.mainloop()
 
     def create_widgets(self):
         self.canvas = tk.Canvas(self, width=self.W, height=self.H-70, bg="white")
         self.scales = tk.Frame()
-        self.scale_1 = tk.Scale(self.scales, from_=0, to_=10, orient=tk.HORIZONTAL, label='Iterations', command=self._n)
+        # вся ломаная — один элемент холста, его точки меняются через coords()
+        self.line = self.canvas.create_line(*self.start.p1, *self.start.p2)
+        self.image = None
+        self.map = self.canvas.create_image(self.W / 2, (self.H - 70) / 2, state=tk.HIDDEN)
+        self.mode = tk.StringVar(value='profile')
+        self.engine = tk.StringVar(value='classic')
+        self.frames = []
+        self.job = None
+        self.scale_1 = tk.Scale(self.scales, from_=0, to_=20, orient=tk.HORIZONTAL, label='Iterations', command=self._n)
         self.scale_2 = tk.Scale(self.scales, from_=0, to_=2, resolution=0.1,
                                 orient=tk.HORIZONTAL, label='Noise', command=self._noise)
         self.scale_3 = tk.Scale(self.scales, from_=0, to_=100, orient=tk.HORIZONTAL, label='Tear', command=self._tear)
+        self.button_1 = tk.Button(self.scales, text='Reseed', command=self.reseed)
+        self.button_2 = tk.Button(self.scales, text='Play', command=self.play)
+        self.button_3 = tk.Button(self.scales, text='Export', command=self.export)
+        self.menu_1 = tk.OptionMenu(self.scales, self.engine, 'classic', *ENGINES, command=self.redraw)
+        self.radio_1 = tk.Radiobutton(self.scales, text='Profile', variable=self.mode, value='profile',
+                                      command=self.redraw)
+        self.radio_2 = tk.Radiobutton(self.scales, text='Heightmap', variable=self.mode, value='heightmap',
+                                      command=self.redraw)
         self.canvas.pack()
         self.scales.pack()
         self.scale_1.pack(side=tk.LEFT)
         self.scale_2.pack(side=tk.LEFT)
         self.scale_3.pack(side=tk.LEFT)
+        self.button_1.pack(side=tk.LEFT, padx=10)
+        self.button_2.pack(side=tk.LEFT)
+        self.button_3.pack(side=tk.LEFT)
+        self.menu_1.pack(side=tk.LEFT)
+        self.radio_1.pack(side=tk.LEFT)
+        self.radio_2.pack(side=tk.LEFT)
         self.scale_1.set(self.n)
         self.scale_2.set(self.noise)
         self.scale_3.set(self.tear)
 
-    def reset(self, *_):
-        self.canvas.delete('all')
-        self.lines = [self.start.copy()]
+    def regenerate(self, seed: int | None = None):
+        """Start a new history, by default with the current seed"""
+        seed = self.mountain.seed if seed is None else seed
+        self.mountain = Mountain(self.mountain.levels[0], self.noise, self.tear, seed)
+        self.heightmap = Heightmap(self.heightmap.levels[0], self.noise, self.tear, seed)
+        self.redraw()
+
+    def redraw(self, *_):
+        self.stop()
+        self.displace()
+        self.draw()
+
+    def play(self):
+        """Show levels 0 to n of the current terrain one after another"""
+        self.redraw()
+        if self.mode.get() == 'heightmap':
+            n = min(self.n, self.map_levels)
+            self.frames = [self.photo(self.heightmap.level(k)) for k in range(n + 1)]
+        else:
+            self.frames = frames([self.profile(k) for k in range(self.n + 1)], self.start.p1.x, self.start.p2.x,
+                                 int(self.start.p2.x - self.start.p1.x))
+        self.frame(0)
+
+    def frame(self, k: int):
+        if k == len(self.frames):
+            self.job = None
+            return
+        if self.mode.get() == 'heightmap':
+            self.canvas.itemconfigure(self.map, image=self.frames[k])
+        else:
+            self.canvas.coords(self.line, self.frames[k].tolist())
+        self.job = self.after(1000 // self.fps, self.frame, k + 1)
+
+    def stop(self):
+        if self.job is not None:
+            self.after_cancel(self.job)
+            self.job = None
+
+    def reseed(self):
+        self.regenerate(getrandbits(32))
+
+    def export(self):
+        """Save the level on screen to .npy, raw float32 or 16-bit .png"""
+        path = filedialog.asksaveasfilename(parent=self, defaultextension='.npy', filetypes=[
+            ('NumPy array', '*.npy'), ('16-bit PNG', '*.png'), ('Raw float32', '*.f32')])
+        if path:
+            save(path, self.heights)
 
     def draw(self):
-        for l in self.lines:
-            l.draw(self.canvas)
+        if self.mode.get() == 'heightmap':
+            self.image = self.photo(self.heights)
+            self.canvas.itemconfigure(self.map, image=self.image, state=tk.NORMAL)
+            self.canvas.itemconfigure(self.line, state=tk.HIDDEN)
+            return
+        self.canvas.itemconfigure(self.map, state=tk.HIDDEN)
+        self.canvas.itemconfigure(self.line, state=tk.NORMAL)
+        xs = np.linspace(self.start.p1.x, self.start.p2.x, len(self.heights))
+        columns = int(self.start.p2.x - self.start.p1.x)
+        self.canvas.coords(self.line, outline(xs, self.heights, columns).tolist())
+
+    def photo(self, heights: np.ndarray) -> tk.PhotoImage:
+        img = shade(heights, self.W, self.H - 70)
+        ppm = b'P6 %d %d 255\n' % (img.shape[1], img.shape[0]) + img.tobytes()
+        return tk.PhotoImage(data=ppm, format='PPM')
 
     def _n(self, n: str):
         self.n = int(n)
-        self.reset()
-        self.displace()
-        self.draw()
+        self.redraw()
 
     def _noise(self, r: str):
         self.noise = float(r)
-        self.reset()
-        self.displace()
-        self.draw()
+        self.regenerate()
 
     def _tear(self, t: str):
         self.tear = int(t)
-        self.reset()
-        self.displace()
-        self.draw()
+        self.regenerate()
 
     def displace(self):
-        if self.n == 0:
-            return
-        gens = 0
-        sentinel = object()
-        lines = []
-        q: Queue[Line | object] = Queue()
-        q.put(self.start.copy())
-        q.put(sentinel)
-        while q:
-            i = q.get()
-            if i is sentinel:
-                gens += 1
-                self.lines = lines
-                lines = []
-                q.put(sentinel)
-                if gens == self.n:
-                    return
-            else:
-                c = i.center
-                c1 = Point(c.x, c.y + self.noise * randint(-self.tear, self.tear))
-                a = Line(i.p1, c1)
-                b = Line(c1, i.p2)
-                q.put(a)
-                q.put(b)
-                lines.append(a)
-                lines.append(b)
+        if self.mode.get() == 'heightmap':
+            self.heights = self.heightmap.level(min(self.n, self.map_levels))
+        else:
+            self.heights = self.profile(self.n)
+
+    def profile(self, n: int) -> np.ndarray:
+        """Level n of the classic history, or a profile of the chosen engine with hurst = Noise / 2"""
+        return engine_profile(self.mountain, self.engine.get(), n)
+
+
+def history(mode: str, noise: float, tear: int, seed: int | None = None) -> Mountain:
+    """The terrain history the app starts with in profile or heightmap mode"""
+    if mode == 'heightmap':
+        return Heightmap(np.zeros((2, 2)), noise, tear, seed)
+    return Mountain([App.H / 2, App.H / 2], noise, tear, seed)
+
+
+def engine_profile(mountain: Mountain, engine: str, n: int) -> np.ndarray:
+    """Level n of the classic history, or a profile of the engine with hurst = noise / 2 and the same seed"""
+    if engine == 'classic':
+        return mountain.level(n)
+    noise = ENGINES[engine](mountain.tear, mountain.noise / 2)
+    return mountain.levels[0][0] + noise.profile(n, np.random.default_rng(mountain.seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Midpoint displacement')
+    parser.add_argument('-o', '--output', help='export tiles to .npy, raw float32 or 16-bit .png without a window')
+    parser.add_argument('--levels', type=int, default=8, help='levels per tile, a tile is 2^levels + 1 wide')
+    parser.add_argument('--tiles', default='1x1', help='number of tiles, ROWSxCOLS')
+    parser.add_argument('--origin', default='0,0', help='first tile, I,J')
+    parser.add_argument('--profile', action='store_true', help='export a 1D profile instead of a heightmap')
+    parser.add_argument('--app', choices=['profile', 'heightmap'],
+                        help='export the terrain of the app instead of tiles; '
+                             'an output name with {k} gets one file per level 0..N')
+    parser.add_argument('-n', type=int, default=App.n, help='level of the app terrain')
+    parser.add_argument('--engine', default='classic', choices=['classic', *ENGINES],
+                        help='noise engine of the app profile')
+    parser.add_argument('-s', '--seed', type=int, help='world seed')
+    parser.add_argument('--noise', type=float, default=App.noise)
+    parser.add_argument('--tear', type=float, default=App.tear)
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes, all cores by default')
+    args = parser.parse_args()
+
+    if args.output is None:
+        App()
+        return
+    if args.app is not None:
+        # как в окне: шкала Tear целочисленная, карта высот не глубже map_levels
+        mountain = history(args.app, args.noise, int(args.tear), args.seed)
+        n = min(args.n, App.map_levels) if args.app == 'heightmap' else args.n
+        for k in range(n + 1) if '{k}' in args.output else [n]:
+            heights = mountain.level(k) if args.app == 'heightmap' else engine_profile(mountain, args.engine, k)
+            path = args.output.format(k=k)
+            shape = save(path, heights)
+            print(f'seed {mountain.seed}: level {k}, {"x".join(map(str, shape))} heights -> {path}')
+        return
+    rows, cols = map(int, args.tiles.split('x'))
+    i, j = map(int, args.origin.split(','))
+    tiles = Tiles(args.levels, args.noise, args.tear, args.seed)
+    shape = export(tiles, args.output, i, j, rows, cols, args.profile, args.jobs)
+    print(f'seed {tiles.seed}: {"x".join(map(str, shape))} heights -> {args.output}')
 
 
 if __name__ == "__main__":
-    App()
+    main()
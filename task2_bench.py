@@ -0,0 +1,62 @@
+"""Benchmark of the terrain noise engines of task2.
+
+Times every engine at growing depth and reports statistics of its
+profiles, so the engines can be compared on speed and on the kind of
+terrain they make. Results go to a JSON file.
+"""
+import argparse
+import json
+from time import perf_counter
+import numpy as np
+from task2 import ENGINES, Mountain
+
+
+def hurst(heights: np.ndarray, lags: int = 8) -> float:
+    """Hurst exponent estimated from how the mean height difference grows with the lag"""
+    lag = 2 ** np.arange(max(2, min(lags, int(np.log2(len(heights))) - 1)))
+    diffs = [np.abs(heights[l:] - heights[:-l]).mean() for l in lag]
+    return float(np.polyfit(np.log(lag), np.log(diffs), 1)[0])
+
+
+def stats(heights: np.ndarray) -> dict:
+    return {'std': float(heights.std()), 'range': float(np.ptp(heights)),
+            'roughness': float(np.abs(np.diff(heights)).mean()), 'hurst': hurst(heights)}
+
+
+def measure(engine, n: int, repeat: int = 3, seed: int = 0) -> dict:
+    """Best time of repeat runs of a depth-n profile and statistics of one of them"""
+    times = []
+    for i in range(repeat):
+        rng = np.random.default_rng((seed, i))
+        start = perf_counter()
+        heights = engine(n, rng)
+        times.append(perf_counter() - start)
+    return {'n': n, 'points': len(heights), 'time_s': min(times),
+            'points_per_s': len(heights) / max(min(times), 1e-9), **stats(heights)}
+
+
+def run(levels: range = range(10, 21, 2), tear: float = 25, h: float = 0.5, repeat: int = 3) -> dict[str, list[dict]]:
+    engines = {'classic': lambda n, rng: Mountain([0, 0], 1, int(tear), int(rng.integers(2**32))).level(n)}
+    engines.update((name, cls(tear, h).profile) for name, cls in ENGINES.items())
+    return {name: [measure(engine, n, repeat) for n in levels] for name, engine in engines.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Terrain noise engine benchmark')
+    parser.add_argument('-o', '--output', default='task2_bench.json', help='where to write the results')
+    parser.add_argument('--levels', type=int, default=20, help='deepest profile, 2^levels + 1 points')
+    parser.add_argument('--hurst', type=float, default=0.5, help='Hurst exponent of the engines')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one counts')
+    args = parser.parse_args()
+
+    results = run(range(10, args.levels + 1, 2), h=args.hurst, repeat=args.repeat)
+    for name, rows in results.items():
+        for row in rows:
+            print(f'{name:9} N={row["n"]:<3} {row["time_s"]:.4f} s  {row["points_per_s"]:>12.0f} points/s  '
+                  f'std {row["std"]:7.2f}  roughness {row["roughness"]:.4f}  H {row["hurst"]:.2f}')
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import os
+import tempfile
+import unittest
+import zlib
+import numpy as np
+from task2 import (ENGINES, Heightmap, Mountain, Tiles, diamond_square, engine_profile, export, frames, history,
+                   outline, refine, save, shade)
+from task2_bench import hurst, run
+
+
+class TestMidpoint(unittest.TestCase):
+    def test_refine(self):
+        rng = np.random.default_rng(0)
+        heights = refine(np.array([0.0, 10.0, 30.0]), 0.5, 4, rng)
+        self.assertEqual(len(heights), 5)
+        np.testing.assert_array_equal(heights[::2], [0, 10, 30])
+        self.assertTrue(np.all(np.abs(heights[1::2] - [5, 20]) <= 2))
+
+    def test_no_tear_is_straight(self):
+        heights = Mountain([300, 100], 1, 0, seed=0).level(6)
+        np.testing.assert_allclose(heights, np.linspace(300, 100, 65))
+
+    def test_deep(self):
+        heights = Mountain([300, 300], 1, 25, seed=1).level(20)
+        self.assertEqual(len(heights), 2**20 + 1)
+        self.assertEqual((heights[0], heights[-1]), (300, 300))
+
+
+class TestMountain(unittest.TestCase):
+    def test_history_is_stable(self):
+        mountain = Mountain([300, 300], 1, 25, seed=7)
+        deep = mountain.level(8).copy()
+        shallow = mountain.level(3)
+        self.assertEqual(len(mountain.levels), 9)
+        np.testing.assert_array_equal(deep[::32], shallow)
+        np.testing.assert_array_equal(mountain.level(8), deep)
+        np.testing.assert_array_equal(Mountain([300, 300], 1, 25, seed=7).level(8), deep)
+
+    def test_noise_scales_offsets(self):
+        a = Mountain([0, 0], 1, 25, seed=3).level(5)
+        b = Mountain([0, 0], 0.5, 25, seed=3).level(5)
+        np.testing.assert_allclose(b, a / 2)
+
+
+class TestOutline(unittest.TestCase):
+    def test_short_is_kept(self):
+        coords = outline(np.array([0.0, 1, 2]), np.array([5.0, 6, 7]), 100)
+        np.testing.assert_array_equal(coords, [0, 5, 1, 6, 2, 7])
+
+    def test_decimated_keeps_extremes(self):
+        heights = Mountain([300, 300], 1, 25, seed=2).level(16)
+        xs = np.linspace(50, 950, len(heights))
+        coords = outline(xs, heights, 900)
+        self.assertLessEqual(len(coords), 2 * (2 * 900 + 2))
+        ys = coords[1::2]
+        self.assertEqual((ys.min(), ys.max()), (heights.min(), heights.max()))
+        self.assertTrue(np.all(np.diff(coords[0::2]) >= 0))
+        self.assertEqual((coords[0], coords[-2]), (50, 950))
+
+
+class TestHeightmap(unittest.TestCase):
+    def test_diamond_square(self):
+        corners = np.array([[0, 4], [8, 12]], dtype=np.float32)
+        grid = diamond_square(corners, 0, np.random.default_rng(0))
+        np.testing.assert_allclose(grid, [[0, 10 / 3, 4], [14 / 3, 6, 22 / 3], [8, 26 / 3, 12]], rtol=1e-6)
+
+    def test_levels(self):
+        heightmap = Heightmap(np.zeros((2, 2)), 1, 25, seed=5)
+        deep = heightmap.level(6)
+        self.assertEqual(deep.shape, (65, 65))
+        np.testing.assert_array_equal(deep[::16, ::16], heightmap.level(2))
+        self.assertLessEqual(np.abs(heightmap.level(1)).max(), 25)
+
+    def test_shade(self):
+        img = shade(Heightmap(np.zeros((2, 2)), 1, 25, seed=5).level(8), 100, 80)
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertEqual(img.shape, (65, 65, 3))
+
+
+class TestTiles(unittest.TestCase):
+    def test_neighbours_share_edges(self):
+        tiles = Tiles(5, 1, 25, seed=3)
+        tile = tiles.tile(-1, 2)
+        self.assertEqual(tile.shape, (33, 33))
+        np.testing.assert_array_equal(tile[:, -1], tiles.tile(-1, 3)[:, 0])
+        np.testing.assert_array_equal(tile[-1], tiles.tile(0, 2)[0])
+        np.testing.assert_array_equal(tile, Tiles(5, 1, 25, seed=3).tile(-1, 2))
+        self.assertEqual(tiles.profile(4)[-1], tiles.profile(5)[0])
+
+    def test_region(self):
+        tiles = Tiles(4, 1, 25, seed=8)
+        region = tiles.region(0, -1, 2, 2, jobs=2)
+        self.assertEqual(region.shape, (33, 33))
+        np.testing.assert_array_equal(region[16:, :17], tiles.tile(1, -1))
+
+
+class TestExport(unittest.TestCase):
+    def test_npy_raw_png(self):
+        tiles = Tiles(4, 1, 25, seed=8)
+        expected = tiles.region(0, 0, 2, 3, jobs=2)
+        with tempfile.TemporaryDirectory() as d:
+            npy = os.path.join(d, 'map.npy')
+            self.assertEqual(export(tiles, npy, 0, 0, 2, 3, jobs=2), (33, 49))
+            np.testing.assert_array_equal(np.load(npy, mmap_mode='r'), expected)
+            raw = os.path.join(d, 'map.f32')
+            export(tiles, raw, 0, 0, 2, 3, jobs=2)
+            np.testing.assert_array_equal(np.fromfile(raw, dtype=np.float32).reshape(33, 49), expected)
+            png = os.path.join(d, 'map.png')
+            export(tiles, png, 0, 0, 2, 3, jobs=2)
+            self.assertEqual(os.listdir(d).count('map.png.f32'), 0)
+            with open(png, 'rb') as f:
+                data = f.read()
+            self.assertEqual(data[:8], b'\x89PNG\r\n\x1a\n')
+            idat, pos = b'', 8
+            while pos < len(data):
+                size = int.from_bytes(data[pos:pos + 4], 'big')
+                if data[pos + 4:pos + 8] == b'IDAT':
+                    idat += data[pos + 8:pos + 8 + size]
+                pos += size + 12
+            rows = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(33, -1)
+            img = rows[:, 1:].copy().view('>u2')
+            self.assertEqual((img.min(), img.max()), (0, 65535))
+            self.assertEqual(np.unravel_index(img.argmax(), img.shape), np.unravel_index(expected.argmax(), expected.shape))
+
+    def test_profile(self):
+        tiles = Tiles(5, 1, 25, seed=2)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'profile.npy')
+            self.assertEqual(export(tiles, path, 0, -2, cols=4, profile=True), (129,))
+            profile = np.load(path)
+            np.testing.assert_array_equal(profile[32:65], tiles.profile(-1).astype(np.float32))
+
+    def test_png_removes_temporary_map_on_error(self):
+        class Broken(Tiles):
+            def profile(self, j):
+                raise RuntimeError('broken tile')
+
+        with tempfile.TemporaryDirectory() as d:
+            with self.assertRaises(RuntimeError):
+                export(Broken(4, 1, 25, seed=1), os.path.join(d, 'profile.png'), cols=2, profile=True)
+            self.assertEqual(os.listdir(d), [])
+
+    def test_app_terrain(self):
+        heightmap = history('heightmap', 1, 25, seed=3)
+        mountain = history('profile', 1, 25, seed=3)
+        with tempfile.TemporaryDirectory() as d:
+            npy = os.path.join(d, 'map.npy')
+            self.assertEqual(save(npy, heightmap.level(4)), (17, 17))
+            np.testing.assert_array_equal(np.load(npy), history('heightmap', 1, 25, seed=3).level(4))
+            raw = os.path.join(d, 'profile.f32')
+            save(raw, engine_profile(mountain, 'perlin', 6))
+            expected = engine_profile(history('profile', 1, 25, seed=3), 'perlin', 6).astype(np.float32)
+            np.testing.assert_array_equal(np.fromfile(raw, dtype=np.float32), expected)
+
+
+class TestFrames(unittest.TestCase):
+    def test_stack(self):
+        mountain = Mountain([300, 300], 1, 25, seed=4)
+        mountain.level(14)
+        stack = frames(mountain.levels, 50, 950, 900)
+        self.assertEqual(len(stack), 15)
+        self.assertEqual(stack.dtype, np.float32)
+        np.testing.assert_array_equal(stack[0, :6], [50, 300, 950, 300, 950, 300])
+        np.testing.assert_array_equal(stack[0, -2:], [950, 300])
+        np.testing.assert_allclose(stack[3, :18:2], np.linspace(50, 950, 9))
+
+
+class TestEngines(unittest.TestCase):
+    def test_profiles(self):
+        for name, engine in ENGINES.items():
+            with self.subTest(name):
+                heights = engine(25, 0.5).profile(12, np.random.default_rng(3))
+                self.assertEqual(len(heights), 2**12 + 1)
+                self.assertEqual(heights.dtype, float)
+                np.testing.assert_array_equal(heights, engine(25, 0.5).profile(12, np.random.default_rng(3)))
+                self.assertLess(np.abs(heights).max(), 200)
+                self.assertAlmostEqual(hurst(heights), 0.5, delta=0.2)
+                self.assertEqual(len(engine().profile(0, np.random.default_rng(3))), 2)
+
+    def test_hurst_controls_roughness(self):
+        rough = ENGINES['spectral'](25, 0.2).profile(14, np.random.default_rng(1))
+        smooth = ENGINES['spectral'](25, 0.9).profile(14, np.random.default_rng(1))
+        self.assertLess(hurst(rough), hurst(smooth))
+
+    def test_benchmark(self):
+        results = run(range(4, 7, 2), repeat=1)
+        self.assertEqual(set(results), {'classic', *ENGINES})
+        self.assertEqual([row['points'] for row in results['perlin']], [17, 65])
+